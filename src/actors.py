@@ -0,0 +1,158 @@
+import queue
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+from torch.distributions.categorical import Categorical
+
+from net import MLP
+from returns import discounted_returns
+
+
+def _actor_loop(idx, policy, version, lock, trajs, stop, obs_dim, act_dim, enemy_num, max_step, repeat, seed):
+    """
+    actor 子进程的主循环：不等待学习者，一局接一局地玩游戏，把轨迹放入有界队列 trajs
+    每局开始时若共享内存中的策略有了新版本，就复制一份到本地，整局游戏都使用这一版本，
+    并把版本号随轨迹一起发出，供学习者计算轨迹的滞后程度
+    """
+    torch.set_num_threads(1)
+    if seed is None:
+        torch.seed()
+    else:
+        torch.manual_seed(seed)
+
+    import environment as Env
+    env = Env.Environment(show=0, debug=0, enemy_num=enemy_num, seed=seed)
+    local = MLP(input_dim=obs_dim, output_dim=act_dim)
+    local_version = -1
+
+    while not stop.is_set():
+        with lock:
+            if version.value != local_version:
+                local.load_state_dict(policy.state_dict())
+                local_version = version.value
+
+        spec = env.get_observation_spec()
+        obs = np.empty((max_step + 1,) + spec['shape'], dtype=spec['dtype'])
+        acts = np.empty(max_step, dtype=np.int64)
+        logp = np.empty(max_step, dtype=np.float32)
+        env._reset(out=obs[0])
+        ep_rews = []
+        while True:
+            step = len(ep_rews)
+            with torch.no_grad():
+                pi = Categorical(logits=local(torch.from_numpy(obs[step])))
+                act = pi.sample()
+                logp[step] = pi.log_prob(act).item()
+            act = act.item()
+            _, rew, done = env.step(act, repeat=repeat, out=obs[step + 1])
+            acts[step] = act
+            ep_rews.append(rew)
+            if done or len(ep_rews) >= max_step:
+                break
+
+        ep_len = len(ep_rews)
+        traj = {
+            'version': local_version,
+            'obs': obs[:ep_len],
+            'acts': acts[:ep_len],
+            'weights': discounted_returns(ep_rews).numpy(),
+            'rews': np.asarray(ep_rews, dtype=np.float32),
+            'logp': logp[:ep_len],
+            'result': (sum(ep_rews), ep_len, env.get_killed_nums()[1], done),
+        }
+        # 队列满时等待学习者取走数据，同时留意停止信号
+        while not stop.is_set():
+            try:
+                trajs.put(traj, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+    # 停止时不必等队列中的数据被取走，进程可以直接退出
+    trajs.cancel_join_thread()
+
+
+class ActorPool:
+    """
+    异步收集数据的 actor 进程
+
+    与 RolloutWorkerPool 不同，actor 不等待主进程的命令，学习者更新参数的同时 actor 继续用稍旧的参数玩游戏。
+    轨迹放在长度有限的队列中，队列满时 actor 暂停，因此轨迹的滞后程度有上限。
+    学习者每次 set_weights 策略版本号加一，一条轨迹的滞后程度 = 取出时的版本号 - 生成它的策略的版本号。
+    轨迹中记录了行为策略给出的动作对数概率 logp，学习者可以据此做离策略修正。
+    """
+
+    def __init__(self, num_actors, obs_dim, act_dim, enemy_num=20, max_step=200, repeat=8, seed=None, queue_size=None):
+        """
+        :param num_actors: int, actor 进程数量
+        :param obs_dim: int, 状态的维度
+        :param act_dim: int, 动作的数量
+        :param enemy_num: int, 每个环境一共会刷新多少个敌方坦克
+        :param max_step: int, 一局游戏中与环境交互的最大次数
+        :param repeat: int, 每个动作在环境中重复执行的帧数
+        :param seed: None/int, 给定时第 i 个 actor 的环境和动作采样都使用种子 seed + i
+        :param queue_size: None/int, 轨迹队列的长度，默认等于 num_actors
+        """
+        ctx = mp.get_context('spawn')
+        self.policy = MLP(input_dim=obs_dim, output_dim=act_dim)
+        self.policy.share_memory()
+        self.version = ctx.Value('i', 0, lock=False)
+        self.lock = ctx.Lock()
+        self.stop = ctx.Event()
+        self.trajs = ctx.Queue(maxsize=queue_size or num_actors)
+        self.procs = []
+        for idx in range(num_actors):
+            proc = ctx.Process(
+                target=_actor_loop,
+                args=(idx, self.policy, self.version, self.lock, self.trajs, self.stop, obs_dim, act_dim,
+                      enemy_num, max_step, repeat, None if seed is None else seed + idx),
+                daemon=True,
+            )
+            proc.start()
+            self.procs.append(proc)
+
+    def set_weights(self, state_dict):
+        """
+        发布学习者的最新参数，actor 在下一局开始时使用
+        :param state_dict: agent.logits_net.state_dict()
+        """
+        with self.lock:
+            self.policy.load_state_dict(state_dict)
+            self.version.value += 1
+
+    def get(self, batch, num_episodes, max_staleness=None):
+        """
+        从队列中取出 num_episodes 局游戏的数据，滞后超过 max_staleness 的轨迹被丢弃，不计入局数
+
+        :param batch: 用于收集数据的字典，除 obs/acts/weights/rews 外还会追加 logp（行为策略的动作对数概率）
+        :param num_episodes: int, 需要的完整游戏局数
+        :param max_staleness: None/int, 可接受的最大滞后版本数，None 表示不限制
+        :return:
+        results: list of (ep_ret, ep_len, killed_enemy, done)，每局游戏一个
+        staleness: list of int, 每局游戏的滞后版本数
+        """
+        results, staleness = [], []
+        while len(results) < num_episodes:
+            traj = self.trajs.get()
+            lag = self.version.value - traj['version']
+            if max_staleness is not None and lag > max_staleness:
+                continue
+            for key in ('obs', 'acts', 'weights', 'rews', 'logp'):
+                batch[key].append(traj[key])
+            ep_ret, ep_len = traj['result'][:2]
+            batch['rets'].append(ep_ret)
+            batch['lens'].append(ep_len)
+            results.append(traj['result'])
+            staleness.append(lag)
+        return results, staleness
+
+    def close(self):
+        """
+        通知 actor 在当前这局游戏结束后退出，队列中剩余的轨迹被丢弃
+        学习者可能在 get 中被中断、队列里留下读了一半的数据，因此这里不再从队列读取
+        """
+        self.stop.set()
+        for proc in self.procs:
+            proc.join()
+        self.trajs.close()
+        self.trajs.join_thread()
@@ -3,7 +3,8 @@ import torch
 from torch.optim import Adam
 from torch.distributions.categorical import Categorical
 
-from net import MLP
+from net import MLP, ValueNet
+from returns import gae
 
 
 cuda_condition = torch.cuda.is_available()
@@ -21,28 +22,113 @@ class AgentVPG:
     2) update
         input - experience obtained by interacting with the environment
         output - losses
+    3) prepare
+        input - the rollout buffer, before it is split into minibatches
+        when lam is given, replaces the reward-to-go weights with GAE advantages
+        with off_policy, scales the weights by the truncated importance ratio
+        between the current policy and the behaviour policy (rollouts.logp)
     """
 
-    def __init__(self, action_space, obs_dim, gamma=1):
+    # name in checkpoints, see AGENTS
+    name = 'vpg'
+    # no critic unless lam is given, class level so agents pickled without these still load
+    value_net = None
+    lam = None
+    gamma = 1
+    # passes over each rollout and whether to shuffle it, train uses these unless configured
+    epochs = 1
+    shuffle = False
+
+    def __init__(self, action_space, obs_dim, gamma=1, lam=None):
         self.logits_net = MLP(input_dim=obs_dim, output_dim=len(action_space))
         self.act_space = list(action_space)
         self.optim = Adam(self.logits_net.parameters(), lr=5e-3)
+        self.gamma = gamma
+        if lam is not None:
+            self.lam = lam
+            self.value_net = ValueNet(input_dim=obs_dim)
+            self.value_optim = Adam(self.value_net.parameters(), lr=1e-3)
+            # rewards are in the thousands, the critic predicts returns divided by this running scale
+            self.ret_scale = None
 
     # make action selection function (outputs int actions, sampled from policy)
     def choose_action(self, obs):
         with torch.no_grad():
             return self._get_policy(obs).sample().item()
 
+    # batched version of choose_action, one forward pass for a stack of states
+    def choose_actions(self, obs):
+        with torch.no_grad():
+            return self._get_policy(obs).sample().tolist()
+
+    # turn the collected rollout into update weights, see the class docstring
+    def prepare(self, rollouts, off_policy=False):
+        n = rollouts.size
+        if n == 0:
+            return
+        if self.value_net is not None:
+            self._prepare_gae(rollouts)
+        if off_policy:
+            # truncated at 1 like V-trace, data from a lagging policy can only count less
+            with torch.no_grad():
+                logp = self._get_policy(rollouts.obs[:n]).log_prob(rollouts.acts[:n])
+            rollouts.weights[:n] *= torch.exp(logp - rollouts.logp[:n]).clamp(max=1.0)
+
+    # GAE advantages over the whole rollout, episodes must not be cut by minibatching
+    def _prepare_gae(self, rollouts):
+        n = rollouts.size
+        with torch.no_grad():
+            values = self.value_net(rollouts.obs[:n])
+        values = values * self.ret_scale if self.ret_scale else torch.zeros_like(values)
+        adv, rets = gae(rollouts.rews[:n], values, rollouts.dones[:n], gamma=self.gamma, lam=self.lam)
+        scale = rets.std().item() + 1e-8 if n > 1 else 1.0
+        self.ret_scale = scale if self.ret_scale is None else 0.9 * self.ret_scale + 0.1 * scale
+        rollouts.returns[:n] = rets / self.ret_scale
+        rollouts.weights[:n] = (adv - adv.mean()) / (adv.std() + 1e-8) if n > 1 else adv
+
     def update(self, batch):
         obs = torch.as_tensor(batch['obs'], dtype=torch.float32)
-        act = torch.as_tensor(batch['acts'], dtype=torch.int32)
+        act = torch.as_tensor(batch['acts'], dtype=torch.int64)
         weights = torch.as_tensor(batch['weights'], dtype=torch.float32)
         batch_loss = self._compute_loss(obs, act, weights)
         self.optim.zero_grad()
         batch_loss.backward()
         self.optim.step()
+        self._update_value(obs, batch)
         return batch_loss.item()
 
+    # constructor arguments besides the spaces, enough to rebuild the agent from a checkpoint
+    def hparams(self):
+        return {'gamma': self.gamma, 'lam': self.lam}
+
+    # parameters and optimizer states only, for checkpoints
+    def state_dict(self):
+        state = {'logits_net': self.logits_net.state_dict(), 'optim': self.optim.state_dict()}
+        if self.value_net is not None:
+            state['value_net'] = self.value_net.state_dict()
+            state['value_optim'] = self.value_optim.state_dict()
+            state['ret_scale'] = self.ret_scale
+        return state
+
+    def load_state_dict(self, state):
+        self.logits_net.load_state_dict(state['logits_net'])
+        if 'optim' in state:
+            self.optim.load_state_dict(state['optim'])
+        if self.value_net is not None and 'value_net' in state:
+            self.value_net.load_state_dict(state['value_net'])
+            self.value_optim.load_state_dict(state['value_optim'])
+            self.ret_scale = state['ret_scale']
+
+    # one critic step towards the GAE returns of the minibatch
+    def _update_value(self, obs, batch):
+        if self.value_net is None:
+            return
+        returns = torch.as_tensor(batch['returns'], dtype=torch.float32)
+        value_loss = ((self.value_net(obs) - returns) ** 2).mean()
+        self.value_optim.zero_grad()
+        value_loss.backward()
+        self.value_optim.step()
+
     # make loss function whose gradient, for the right data, is policy gradient
     def _compute_loss(self, obs, act, weights):
         logp = self._get_policy(obs).log_prob(act)
@@ -54,3 +140,55 @@ class AgentVPG:
         logits = self.logits_net(obs)
         return Categorical(logits=logits)
 
+
+class AgentPPO(AgentVPG):
+    """
+    Agent trained with the PPO clipped objective
+
+    Same interface as AgentVPG. prepare also records the log-probabilities
+    of the collected actions under the current policy, so update can take
+    several steps on the same rollout without moving too far from it.
+    """
+
+    name = 'ppo'
+    epochs = 4
+    shuffle = True
+
+    def __init__(self, action_space, obs_dim, gamma=1, lam=0.95, clip=0.2, ent_coef=0.01):
+        super(AgentPPO, self).__init__(action_space, obs_dim, gamma=gamma, lam=lam)
+        self.clip = clip
+        self.ent_coef = ent_coef
+
+    def hparams(self):
+        hparams = super(AgentPPO, self).hparams()
+        hparams.update(clip=self.clip, ent_coef=self.ent_coef)
+        return hparams
+
+    # off-policy data keeps the behaviour log-probabilities, the clipped ratio then corrects for the lag
+    def prepare(self, rollouts, off_policy=False):
+        super(AgentPPO, self).prepare(rollouts)
+        if off_policy:
+            return
+        n = rollouts.size
+        with torch.no_grad():
+            rollouts.logp[:n] = self._get_policy(rollouts.obs[:n]).log_prob(rollouts.acts[:n])
+
+    def update(self, batch):
+        obs = torch.as_tensor(batch['obs'], dtype=torch.float32)
+        act = torch.as_tensor(batch['acts'], dtype=torch.int64)
+        adv = torch.as_tensor(batch['weights'], dtype=torch.float32)
+        old_logp = torch.as_tensor(batch['logp'], dtype=torch.float32)
+
+        pi = self._get_policy(obs)
+        ratio = torch.exp(pi.log_prob(act) - old_logp)
+        clipped = torch.clamp(ratio, 1 - self.clip, 1 + self.clip)
+        batch_loss = -torch.min(ratio * adv, clipped * adv).mean() - self.ent_coef * pi.entropy().mean()
+        self.optim.zero_grad()
+        batch_loss.backward()
+        self.optim.step()
+        self._update_value(obs, batch)
+        return batch_loss.item()
+
+
+# algorithms by the name train's config and checkpoints use
+AGENTS = {agent_class.name: agent_class for agent_class in (AgentVPG, AgentPPO)}
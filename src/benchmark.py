@@ -0,0 +1,40 @@
+import time
+import random
+
+import environment as Env
+
+
+def benchmark(steps=10000, enemy_num=20, max_active_enemies=4, seed=0):
+    """
+    测量环境每秒可以运行的帧数（_step 调用次数）
+    环境不显示画面、使用固定的种子，动作也由固定种子的随机数生成，因此每次测量运行的是完全相同的游戏过程
+
+    :param steps: int, 运行的总帧数
+    :param enemy_num: int, 每局游戏一共会刷新多少个敌方坦克
+    :param max_active_enemies: int, 场上同时存在的敌方坦克数量上限
+    :param seed: int, 环境和动作的随机数种子
+    :return: float, 每秒帧数
+    """
+    env = Env.Environment(show=0, debug=0, enemy_num=enemy_num, seed=seed)
+    env._reset(seed=seed)
+    env.level.max_active_enemies = max_active_enemies
+    env.resnapshot()
+    rng = random.Random(seed)
+
+    t = time.perf_counter()
+    for _ in range(steps):
+        _, _, done = env._step(rng.randrange(6))
+        if done:
+            env._reset()
+    return steps / (time.perf_counter() - t)
+
+
+if __name__ == '__main__':
+    config = {
+        'steps': 10000,
+        'enemy_num': 20,
+        'max_active_enemies': 4,
+        'seed': 0,
+    }
+
+    print(f'{benchmark(**config):.0f} steps/s')
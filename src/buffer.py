@@ -0,0 +1,93 @@
+import torch
+
+
+class RolloutBuffer:
+    """
+    存放一轮收集到的轨迹数据，供学习者分成小批量更新
+
+    obs/acts/weights 是按容量预先分配的 tensor，每局游戏的数据依次复制到末尾。
+    不打乱顺序时小批量就是这些 tensor 的切片；打乱顺序时按随机排列把数据取到
+    预先分配的小批量 tensor 中，因此更新过程中几乎不再分配内存。
+    """
+
+    # 小批量中包含的数据
+    MINIBATCH_KEYS = ('obs', 'acts', 'weights', 'returns', 'logp')
+
+    def __init__(self, capacity, obs_dim):
+        """
+        :param capacity: int, 最多存放的步数
+        :param obs_dim: int, 状态的维度
+        """
+        self.capacity = capacity
+        self.obs = torch.zeros(capacity, obs_dim)
+        self.acts = torch.zeros(capacity, dtype=torch.int64)
+        self.weights = torch.zeros(capacity)
+        # 以下三项供带价值网络的智能体使用：每步奖励、一局游戏的最后一步标记、价值网络的目标
+        self.rews = torch.zeros(capacity)
+        self.dones = torch.zeros(capacity)
+        self.returns = torch.zeros(capacity)
+        # 收集数据时的策略给出的动作对数概率，供 PPO 使用
+        self.logp = torch.zeros(capacity)
+        self.size = 0
+        self._perm = torch.empty(capacity, dtype=torch.int64)
+        self._minibatch = None
+
+    def add(self, obs, acts, weights, rews=None, logp=None):
+        """
+        把一局游戏的数据复制到缓冲区末尾
+
+        :param obs: numpy.ndarray/tensor, (ep_len, obs_dim)
+        :param acts: numpy.ndarray/tensor, (ep_len,)
+        :param weights: numpy.ndarray/tensor, (ep_len,)
+        :param rews: None/numpy.ndarray/tensor, (ep_len,)，每一步的奖励
+        :param logp: None/numpy.ndarray/tensor, (ep_len,)，收集数据的策略给出的动作对数概率
+        """
+        start, end = self.size, self.size + len(obs)
+        if end > self.capacity:
+            raise ValueError(f'RolloutBuffer 容量为 {self.capacity}，无法再放入 {len(obs)} 步数据')
+        self.obs[start:end] = torch.as_tensor(obs)
+        self.acts[start:end] = torch.as_tensor(acts)
+        self.weights[start:end] = torch.as_tensor(weights)
+        if rews is not None:
+            self.rews[start:end] = torch.as_tensor(rews)
+        if logp is not None:
+            self.logp[start:end] = torch.as_tensor(logp)
+        self.dones[start:end] = 0
+        self.dones[end - 1] = 1
+        self.size = end
+
+    def clear(self):
+        """
+        清空缓冲区，已分配的 tensor 留给下一轮复用
+        """
+        self.size = 0
+
+    def minibatches(self, batch_size, epochs=1, shuffle=False):
+        """
+        依次生成小批量数据，不足 batch_size 的最后一部分数据被丢弃
+
+        :param batch_size: int, 每个小批量的步数
+        :param epochs: int, 把全部数据过几遍
+        :param shuffle: bool, 是否每一遍都按新的随机排列取数据（使用 torch 的全局随机数生成器）
+        :return: 生成器，每次给出一个含 MINIBATCH_KEYS 中各项的字典。
+            打乱顺序时字典中的 tensor 在生成下一个小批量时会被覆盖，需要在此之前用完
+        """
+        num_batches = self.size // batch_size
+        if shuffle and (self._minibatch is None or len(self._minibatch['obs']) != batch_size):
+            self._minibatch = {
+                key: getattr(self, key).new_empty((batch_size,) + getattr(self, key).shape[1:])
+                for key in self.MINIBATCH_KEYS
+            }
+        perm = self._perm[:self.size]
+        for _ in range(epochs):
+            if shuffle:
+                torch.randperm(self.size, out=perm)
+            for i in range(num_batches):
+                if not shuffle:
+                    yield {key: getattr(self, key)[i*batch_size:(i+1)*batch_size] for key in self.MINIBATCH_KEYS}
+                    continue
+                idx = perm[i*batch_size:(i+1)*batch_size]
+                minibatch = self._minibatch
+                for key in self.MINIBATCH_KEYS:
+                    torch.index_select(getattr(self, key), 0, idx, out=minibatch[key])
+                yield minibatch
@@ -0,0 +1,260 @@
+import copy
+import glob
+import json
+import os
+import pickle
+import queue
+import re
+import sys
+import threading
+import time
+import zipfile
+
+import numpy as np
+import torch
+
+
+# 检查点格式：只含 tensor 和基本类型，torch.load(weights_only=True) 即可读取，不需要导入 agent/net
+# 'policy' 是策略网络的 state_dict，'training' 是继续训练才需要的优化器、价值网络等状态，
+# 用 mmap 载入时只读取实际访问到的 tensor，评估时不会读入 'training' 部分
+FORMAT = 'tank-battle-agent'
+FORMAT_VERSION = 1
+
+
+def make_checkpoint(agent, episode, obs_spec):
+    """
+    把智能体打包成检查点字典
+
+    :param agent: AgentVPG/AgentPPO
+    :param episode: int, 已训练的轮数
+    :param obs_spec: dict, Environment.get_observation_spec() 的返回值
+    :return: dict
+    """
+    state = agent.state_dict()
+    return {
+        'format': FORMAT,
+        'version': FORMAT_VERSION,
+        'algo': agent.name,
+        'hparams': agent.hparams(),
+        'obs_spec': {'shape': list(obs_spec['shape']), 'dtype': np.dtype(obs_spec['dtype']).name},
+        'act_dim': len(agent.act_space),
+        'episode': episode,
+        'policy': state.pop('logits_net'),
+        'training': state,
+    }
+
+
+def load_checkpoint(path, mmap=True):
+    """
+    读取检查点，tensor 默认以 mmap 方式延迟载入
+
+    :param path: str, 检查点文件
+    :param mmap: bool, 是否用 mmap 载入 tensor
+    :return: dict, 格式见 make_checkpoint
+    """
+    ckpt = torch.load(path, mmap=mmap, weights_only=True, map_location='cpu')
+    if not isinstance(ckpt, dict) or ckpt.get('format') != FORMAT:
+        raise ValueError(f'{path} 不是智能体检查点')
+    if ckpt['version'] > FORMAT_VERSION:
+        raise ValueError(f'{path} 的格式版本为 {ckpt["version"]}，只支持到 {FORMAT_VERSION}')
+    return ckpt
+
+
+def build_agent(ckpt, training=False):
+    """
+    按检查点中记录的算法和超参数新建智能体并载入参数
+
+    :param ckpt: dict, load_checkpoint 的返回值
+    :param training: bool, 是否同时载入优化器等继续训练所需的状态
+    :return: AgentVPG/AgentPPO
+    """
+    from agent import AGENTS
+    agent = AGENTS[ckpt['algo']](action_space=range(ckpt['act_dim']), obs_dim=ckpt['obs_spec']['shape'][0],
+                                 **ckpt['hparams'])
+    state = {'logits_net': ckpt['policy']}
+    if training:
+        state.update(ckpt['training'])
+    agent.load_state_dict(state)
+    return agent
+
+
+def load_agent(path, training=False):
+    """
+    读取检查点或旧版本保存的整个智能体对象（torch.save(agent) 的 log_*.pkl）
+
+    :param path: str
+    :param training: bool, 同 build_agent
+    :return: AgentVPG/AgentPPO
+    """
+    if zipfile.is_zipfile(path):
+        try:
+            return build_agent(load_checkpoint(path), training)
+        except (pickle.UnpicklingError, ValueError):
+            pass
+    return torch.load(path, weights_only=False)
+
+
+def convert(path):
+    """
+    把旧版本的 log_*.pkl 转换为同名的 .pt 检查点，轮数取自文件名
+    :return: str, 新文件的路径
+    """
+    agent = load_agent(path)
+    episode = int(re.search(r'(\d+)', os.path.basename(path)).group(1))
+    obs_spec = {'shape': (agent.logits_net.mlp[0].in_features,), 'dtype': np.float32}
+    new_path = os.path.splitext(path)[0] + '.pt'
+    torch.save(make_checkpoint(agent, episode, obs_spec), new_path + '.tmp')
+    os.replace(new_path + '.tmp', new_path)
+    return new_path
+
+
+class CheckpointManager:
+    """
+    在后台线程中保存检查点
+
+    训练线程只负责复制一份参数（state_dict），写文件在后台线程完成，不会阻塞数据收集和更新。
+    文件先写到临时文件再用 os.replace 改名，因此目录中不会出现写了一半的检查点。
+    按轮数（every_steps）和/或时间（every_seconds）决定何时保存，
+    只保留最近的 keep_last 个和得分最高的 keep_best 个检查点，得分记录在目录中的 checkpoints.json。
+    不接着上次训练时（resume=False），目录中已有的检查点属于上一次训练，
+    会被移到 old_runs/ 下的子目录中，不参与新一次训练的挑选，也不会被新的检查点覆盖。
+    """
+
+    OLD_RUNS_DIR = 'old_runs'
+
+    INDEX_FILE = 'checkpoints.json'
+
+    def __init__(self, directory, keep_last=3, keep_best=3, every_steps=None, every_seconds=None, resume=True):
+        """
+        :param directory: str, 保存检查点的目录
+        :param keep_last: int, 保留最近的几个检查点
+        :param keep_best: int, 保留得分最高的几个检查点
+        :param every_steps: None/int, 每隔多少轮保存一次
+        :param every_seconds: None/float, 每隔多少秒保存一次，与 every_steps 同时给定时满足任一条件即保存
+        :param resume: bool, 是否接着目录中已有的检查点继续训练，为 False 时把它们移走
+        """
+        self.directory = directory
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        self.every_steps = every_steps
+        self.every_seconds = every_seconds
+        self.last_time = time.time()
+        os.makedirs(directory, exist_ok=True)
+        # 上次训练被中断时没写完的临时文件
+        for path in glob.glob(os.path.join(directory, 'ckpt_*.pt.tmp')):
+            os.remove(path)
+        if not resume:
+            self._move_old_run()
+
+        # 轮数 => 得分，包括目录中已有的检查点
+        self.index = {}
+        index_path = os.path.join(directory, self.INDEX_FILE)
+        if os.path.isfile(index_path):
+            with open(index_path) as f:
+                self.index = {int(step): score for step, score in json.load(f).items()}
+        for path in glob.glob(os.path.join(directory, 'ckpt_*.pt')):
+            step = int(re.search(r'ckpt_(\d+)\.pt$', path).group(1))
+            self.index.setdefault(step, None)
+        self.index = {step: score for step, score in self.index.items() if os.path.isfile(self.path(step))}
+
+        self.jobs = queue.Queue()
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    def _move_old_run(self):
+        """
+        把目录中已有的检查点和 checkpoints.json 移到 old_runs/run_{n}/，n 从 1 开始依次增加
+        :return: None/str, 移到的目录，没有已有的检查点时为 None
+        """
+        paths = glob.glob(os.path.join(self.directory, 'ckpt_*.pt'))
+        index_path = os.path.join(self.directory, self.INDEX_FILE)
+        if os.path.isfile(index_path):
+            paths.append(index_path)
+        if not paths:
+            return None
+        n = 1
+        while os.path.exists(os.path.join(self.directory, self.OLD_RUNS_DIR, f'run_{n}')):
+            n += 1
+        old_run = os.path.join(self.directory, self.OLD_RUNS_DIR, f'run_{n}')
+        os.makedirs(old_run)
+        for path in paths:
+            os.replace(path, os.path.join(old_run, os.path.basename(path)))
+        return old_run
+
+    def path(self, step):
+        return os.path.join(self.directory, f'ckpt_{step}.pt')
+
+    def latest(self):
+        """
+        :return: str/None, 轮数最大的检查点的路径
+        """
+        return self.path(max(self.index)) if self.index else None
+
+    def should_save(self, step):
+        if self.every_steps and step % self.every_steps == 0:
+            return True
+        return bool(self.every_seconds) and time.time() - self.last_time >= self.every_seconds
+
+    def maybe_save(self, step, score, get_state):
+        """
+        按保存频率决定是否保存，需要保存时才调用 get_state 取得状态
+
+        :param step: int, 当前轮数
+        :param score: float, 用于挑选最好检查点的得分（例如本轮的平均回报）
+        :param get_state: callable, 返回要保存的字典（其中的 tensor 可以是正在训练的参数）
+        :return: bool, 是否保存了
+        """
+        if not self.should_save(step):
+            return False
+        self.save(step, score, get_state())
+        return True
+
+    def save(self, step, score, state):
+        """
+        复制 state 后交给后台线程写入，立即返回
+        """
+        self.last_time = time.time()
+        self.jobs.put((step, score, copy.deepcopy(state)))
+
+    def _write_loop(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            step, score, state = job
+            path = self.path(step)
+            torch.save(state, path + '.tmp')
+            os.replace(path + '.tmp', path)
+            self.index[step] = score
+            self._prune()
+
+    def _prune(self):
+        """
+        删除既不是最近 keep_last 个、也不是得分最高 keep_best 个的检查点，并更新 checkpoints.json
+        """
+        steps = sorted(self.index)
+        keep = set(steps[-self.keep_last:]) if self.keep_last else set()
+        scored = sorted((step for step in steps if self.index[step] is not None), key=lambda step: self.index[step])
+        if self.keep_best:
+            keep.update(scored[-self.keep_best:])
+        for step in steps:
+            if step not in keep:
+                del self.index[step]
+                os.remove(self.path(step))
+        index_path = os.path.join(self.directory, self.INDEX_FILE)
+        with open(index_path + '.tmp', 'w') as f:
+            json.dump(self.index, f)
+        os.replace(index_path + '.tmp', index_path)
+
+    def close(self):
+        """
+        等待已提交的检查点全部写完
+        """
+        self.jobs.put(None)
+        self._thread.join()
+
+
+if __name__ == '__main__':
+    # python checkpoint.py logs/explore/log_*.pkl
+    for path in sys.argv[1:]:
+        print(convert(path))
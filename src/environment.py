@@ -5,9 +5,30 @@ import tanks
 import pygame
 import random
 import time
+import numpy as np
 
 EPS = 16 # 一个格子的大小
 WIDTH, HEIGHT = 480 // EPS - 4, 416 // EPS
+TICK = 20 # 不显示画面时，每帧推进的游戏时间（毫秒）
+HISTORY = 1200 # _get_reward 记住的坦克历史位置数量
+
+
+def _copy_state(value):
+    """
+    复制对象的一个属性值，使之后对原值的原地修改（列表增删、字典赋值、Rect 移动）不影响副本
+    列表中的字典也复制一层，其余元素（坦克、图片、计时器的元组等）直接共享
+    """
+    if isinstance(value, list):
+        return [dict(item) if isinstance(item, dict) else item for item in value]
+    if isinstance(value, dict):
+        return dict(value)
+    if isinstance(value, bytearray):
+        return bytearray(value)
+    if isinstance(value, np.ndarray):
+        return value.copy()
+    if isinstance(value, pygame.Rect):
+        return pygame.Rect(value)
+    return value
 
 
 class Environment(tanks.Game):
@@ -20,20 +41,32 @@ class Environment(tanks.Game):
     铁块的大小为： 16 * 16
     地图中只用铁和空地两种地形，铁永远无法被破坏。
     玩家和基地始终处于无敌状态。
+
+    _reset() 不重新运行 __init__，而是把环境恢复到构造结束时记录的快照。
+    构造之后对环境的修改（例如 env.level.max_active_enemies = 4）会在下一次 _reset 时丢失，
+    需要保留时在修改后调用 resnapshot()，以当前状态作为之后每局游戏的初始状态。
+    给定 seed 的 _reset 会重新运行 __init__，之前的修改和快照都不保留。
     """
 
-    def __init__(self, show, debug=False, enemy_num=20):
+    def __init__(self, show, debug=False, enemy_num=20, seed=None, dt=None):
         """
         环境初始化需要的一些参数和设置，你不需要修改这个函数中的内容
 
-        :param show: 0/1, 是否展示画面
+        :param show: 0/1, 是否展示画面，为0时游戏只运行逻辑部分，不初始化 pygame 的窗口、图片和字体
         :param debug: 0/1, 是否打印环境中的信息
         :param enemy_num: int, 一共会刷新多少个敌方坦克
+        :param seed: None/int, 游戏中随机数的种子。给定种子且动作相同时，每次运行得到的轨迹完全相同
+        :param dt: None/int, 每帧推进的游戏时间（毫秒）。None 表示显示画面时使用实际经过的时间，不显示时使用 TICK
         """
 
-        super().__init__(show=show)
+        # 随机数生成器在多局游戏之间保持不变，只有给定新的种子时才重新生成
+        if seed is not None or not hasattr(self, 'rng'):
+            self.rng = random.Random(seed)
+        self.dt = dt
+
+        super().__init__(show=show, world=tanks.World(headless=not show, rng=self.rng))
 
-        tanks.castle = tanks.Castle()
+        self.world.castle = tanks.Castle(self.world)
 
         self.game_over = False
         self.stage = 1
@@ -42,26 +75,24 @@ class Environment(tanks.Game):
         self.show = show
         self.enemy_num = enemy_num
 
-        # clear all timers
-        del tanks.gtimer.timers[:]
-        del tanks.players[:]
-        del tanks.bullets[:]
-        del tanks.enemies[:]
-        del tanks.bonuses[:]
-        del tanks.gtimer.timers[:]
-
-        tanks.castle.rebuild()
-        self.level = tanks.Level(1)
+        self.level = tanks.Level(self.world, 1)
         self.level.enemies_left = [0] * self.enemy_num
         self.reloadPlayers()
-        self.map_track = [0] * WIDTH * HEIGHT
-        tanks.gtimer.add(500, lambda: self.spawnEnemy())
+        # 每个地图格子一个字节，1 表示到达过或是铁块，0 表示未到达
+        # track_visited 记录值为 1 的格子数量，只通过 _track 修改格子，使计数始终准确
+        self.map_track = bytearray(WIDTH * HEIGHT)
+        self.track_visited = 0
+        self.world.timer.add(500, lambda: self.spawnEnemy())
 
         # make castle invulnerable
         self.level.buildFortress(self.level.TILE_STEEL)
         self._init()
         self.action_logs = [-1] * 10  # 原为 * 10
-
+        # 只在构造时检查一次状态的格式，之后 step/_reset 可以把状态直接写入预先分配的 float32 数组
+        state = self._get_state()
+        self.__checker(state, 0)
+        self.obs_dim = len(state)
+        self._save_snapshot()
 
     def _step(self, action):
         """
@@ -75,24 +106,71 @@ class Environment(tanks.Game):
         reward：a number, 给予Agent的奖励
         done: 1/0/True/False, 游戏是否结束
         """
+        return self.step(action, repeat=1)
+
+    def step(self, action, repeat=1, out=None):
+        """
+        把同一个动作连续执行 repeat 帧，只在最后计算一次状态并检查一次输出
+        _get_reward 记录了坦克每一帧的位置，因此仍然逐帧调用，返回各帧奖励之和除以 repeat
+        某一帧游戏结束时立即停止，不再执行剩下的帧
+        动作同时记入 action_logs（最近 10 个动作）
+
+        :param action: int， 来自Agent，含义同 _step
+        :param repeat: int, 动作重复执行的帧数
+        :param out: None/numpy.ndarray, 形状和类型符合 get_observation_spec() 的数组（通常是轨迹缓冲区中的一行），
+            给定时状态直接写入 out 并返回 out，不再检查格式
+        :return:
+        state：list of nums/out, 最后一帧之后环境的状态
+        reward：a number, 实际执行的各帧奖励之和除以 repeat
+        done: True/False, 游戏是否结束（可能在第 repeat 帧之前就已结束）
+        """
         self.kill = 0
-        time_passed = self.clock.tick(50*tanks.quick)
+        if self.show:
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    exit(0)
+        reward = 0
+        for i in range(repeat):
+            done = self._tick(action)
+            # _get_reward 会修改 map_track，所以状态要在最后一帧的奖励之前计算
+            if done or i == repeat - 1:
+                state = self._get_state()
+            reward = reward + self._get_reward()
+            if done:
+                break
+        reward = reward / repeat
+        self.action_logs.pop(0)
+        self.action_logs.append(action)
+        if out is not None:
+            out[:] = state
+            return out, reward, done
+        self.__checker(state, reward)
+        return state, reward, done
+
+    def _tick(self, action):
+        """
+        游戏推进一帧：执行动作，更新坦克、子弹和计时器，并在 map_track 中记录坦克到达的位置
+        本帧击杀的敌人数累加到 self.kill
+
+        :param action: int， 来自Agent，含义同 _step
+        :return: bool, 敌人是否已被全部击杀
+        """
+        world = self.world
+        # 不显示画面时不依赖 pygame 的时钟和事件，每帧固定推进 dt（默认 TICK）毫秒
+        time_passed = TICK if self.dt is None else self.dt
+        if self.show:
+            elapsed = self.clock.tick(50*tanks.quick)
+            if self.dt is None:
+                time_passed = elapsed
         # make player invulnerable
-        self.shieldPlayer(tanks.players[0], True, None)
+        # 只在护盾失效时重新加上，否则每帧都会多注册一个切换护盾图片的计时器
+        if not world.players[0].shielded:
+            self.shieldPlayer(world.players[0], True, None)
 
-        player = tanks.players[0]
+        player = world.players[0]
         direction = (self.DIR_UP, self.DIR_RIGHT, self.DIR_DOWN, self.DIR_LEFT)
 
-        # 是否显示画面
-        # if self.show:
-        #     for _ in pygame.event.get():
-        #         pass
-        
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                exit(0)
-
-        del tanks.bonuses[:]
+        del world.bonuses[:]
 
         # 执行动作
         if action == 0:
@@ -104,57 +182,121 @@ class Environment(tanks.Game):
         player.update(time_passed)
 
         # 更新敌人状态
-        for enemy in tanks.enemies:
+        for enemy in world.enemies:
             if enemy.state == enemy.STATE_DEAD:
-                tanks.enemies.remove(enemy)
+                world.enemies.remove(enemy)
                 self.kill += 1
-                if len(self.level.enemies_left) == 0 and len(tanks.enemies) == 0:
-                    state, reward = self._get_state(), self._get_reward()
-                    self.__checker(state, reward)
-                    return state, reward, True
+                if len(self.level.enemies_left) == 0 and len(world.enemies) == 0:
+                    return True
             else:
                 enemy.update(time_passed)
 
         # 更新子弹状态
-        for bullet in tanks.bullets:
+        for bullet in world.bullets:
             if bullet.state == bullet.STATE_REMOVED:
-                tanks.bullets.remove(bullet)
+                world.bullets.remove(bullet)
             else:
                 bullet.update()
 
-        for label in tanks.labels:
+        for label in world.labels:
             if not label.active:
-                tanks.labels.remove(label)
+                world.labels.remove(label)
 
-        tanks.gtimer.update(time_passed)
+        world.timer.update(time_passed)
 
         if self.show:
             self.draw()
 
         # 更新地图中坦克到达过的位置，记录在此前后未到达位置数量
         curpos = (round((self.get_tanks_position()[0][0] - 3) / EPS), round((self.get_tanks_position()[0][1] - 3) / EPS))
-        self.pre_null = list.count(self.map_track, 0)
-        self.map_track[curpos[0] + curpos[1] * WIDTH] = 1
-        self.map_track[curpos[0] + 1 + curpos[1] * WIDTH] = 1
-        self.map_track[curpos[0] + (curpos[1] + 1) * WIDTH] = 1
-        self.map_track[curpos[0] + 1 + (curpos[1] + 1) * WIDTH] = 1
-        self.after_null = list.count(self.map_track, 0)
-
-        state, reward = self._get_state(), self._get_reward()#TODO something
-        self.__checker(state, reward)
-        return state, reward, False
+        self.pre_null = len(self.map_track) - self.track_visited
+        self._track_tank(curpos[0], curpos[1], 1)
+        self.after_null = len(self.map_track) - self.track_visited
+        return False
 
-    def _reset(self):
+    def _track(self, index, value):
+        """
+        修改 map_track 中的一个格子，同时更新到达过的格子数量 track_visited
+
+        :param index: int, 格子在 map_track 中的下标
+        :param value: 0/1, 格子的新值
+        """
+        if self.map_track[index] != value:
+            self.map_track[index] = value
+            self.track_visited += 1 if value else -1
+
+    def _track_tank(self, x, y, value):
+        """
+        修改坦克占用的 2*2 个格子
+        :param x: int, 坦克左上角格子的横坐标
+        :param y: int, 坦克左上角格子的纵坐标
+        :param value: 0/1, 格子的新值
+        """
+        self._track(x + y * WIDTH, value)
+        self._track(x + 1 + y * WIDTH, value)
+        self._track(x + (y + 1) * WIDTH, value)
+        self._track(x + 1 + (y + 1) * WIDTH, value)
+
+    def _reset(self, seed=None, out=None):
         """
         重置环境，并返回初始状态。你不需要修改这个部分。
+        :param seed: None/int, 给定时用新的种子重新生成随机数生成器，用于复现某一局游戏
+        :param out: None/numpy.ndarray, 同 step，给定时初始状态直接写入 out
         :return:
         state，0，False
         """
-        self.__init__(show=self.show, debug=self.Debug, enemy_num=self.enemy_num)
+        if seed is None and self._snapshot['show'] == self.show:
+            self._restore_snapshot()
+        else:
+            self.__init__(show=self.show, debug=self.Debug, enemy_num=self.enemy_num, seed=seed, dt=self.dt)
         state, reward = self._get_state(), 0
+        if out is not None:
+            out[:] = state
+            return out, reward, False
         self.__checker(state, reward)
         return state, reward, False
 
+    def get_observation_spec(self):
+        """
+        状态的格式，用于预先分配存放状态的数组，例如
+        numpy.empty((n,) + spec['shape'], dtype=spec['dtype'])
+
+        :return: dict, shape: 单个状态的形状, dtype: 元素类型
+        """
+        return {'shape': (self.obs_dim,), 'dtype': np.float32}
+
+    def _save_snapshot(self):
+        """
+        记录初始化完成后环境、地图、玩家、基地和计时器的全部属性，
+        之后的 _reset 直接恢复这些属性，而不是重新运行 __init__
+        （重新初始化 pygame、加载图片和字体、重建地图和基地）
+        """
+        objects = [self, self.world, self.world.timer, self.world.castle, self.level] + self.world.players
+        self._snapshot = {
+            'show': self.show,
+            'objects': [
+                (obj, {key: _copy_state(value) for key, value in vars(obj).items() if key != '_snapshot'})
+                for obj in objects
+            ],
+        }
+
+    def resnapshot(self):
+        """
+        以环境的当前状态作为之后 _reset 恢复的初始状态，应在一局游戏开始前（刚 _reset 之后）修改完设置再调用
+        """
+        self._save_snapshot()
+
+    def _restore_snapshot(self):
+        """
+        把所有对象恢复到 _save_snapshot 时的状态，之后新增的属性（如爆炸效果）一并删除
+        随机数生成器不恢复，因此每局游戏仍然各不相同
+        """
+        snapshot = self._snapshot
+        for obj, state in snapshot['objects']:
+            obj.__dict__.clear()
+            obj.__dict__.update({key: _copy_state(value) for key, value in state.items()})
+        self._snapshot = snapshot
+
     def __checker(self, state, reward):
         """
         检查输出的 state 和 reward 是否合法
@@ -190,8 +332,8 @@ class Environment(tanks.Game):
         player_pos: a Tuple
         en_pos: a list of Tuple
         """
-        player_pos = tanks.players[0].rect.topleft
-        en_pos = [en.rect.topleft for en in tanks.enemies]
+        player_pos = self.world.players[0].rect.topleft
+        en_pos = [en.rect.topleft for en in self.world.enemies]
         return player_pos, en_pos
 
     def get_tanks_direction(self):
@@ -202,8 +344,8 @@ class Environment(tanks.Game):
         player_dir: int
         en_dir: a list of int
         """
-        player_dir = tanks.players[0].direction
-        en_dir = [en.direction for en in tanks.enemies]
+        player_dir = self.world.players[0].direction
+        en_dir = [en.direction for en in self.world.enemies]
         return player_dir, en_dir
 
     def get_killed_nums(self):
@@ -217,7 +359,7 @@ class Environment(tanks.Game):
         """
 
         left = len(self.level.enemies_left)
-        alive = len(tanks.enemies)
+        alive = len(self.world.enemies)
         killed = self.enemy_num - alive - left
         return self.kill, killed, alive, left
 
@@ -242,16 +384,17 @@ class Environment(tanks.Game):
         你可以根据自己的想法修改这个函数中的变量，以及添加/删除其他的变量。
         """
 
-        self.laststate = [(self.get_tanks_position()[0][0] - 3,self.get_tanks_position()[0][1] - 3),]#修改为 a list of tuple
+        # 坦克最近 HISTORY 帧的位置，环形缓冲区：前 laststate_len 行有效，laststate_next 是下一个写入（也是最早一条记录）的行
+        # laststate_counts 记录每个位置在缓冲区中出现的次数，用于 O(1) 判断当前位置是否重复
+        self.laststate = np.zeros((HISTORY, 2), dtype=np.int64)
+        self.laststate_len, self.laststate_next, self.laststate_counts = 0, 0, {}
+        self._remember((self.get_tanks_position()[0][0] - 3,self.get_tanks_position()[0][1] - 3))
         # 对地图上的障碍物铁块进行记录
         for tup in self.get_steel_position():
-            self.map_track[tup[0]//EPS + (tup[1]//EPS) * WIDTH] = 1
+            self._track(tup[0]//EPS + (tup[1]//EPS) * WIDTH, 1)
         # 记录初始坦克所在位置，为到达过的位置，初始化未到达位置数量
-        self.map_track[round((self.get_tanks_position()[0][0] - 3) / EPS) + round((self.get_tanks_position()[0][1] - 3) / EPS)  * WIDTH] = 1
-        self.map_track[round((self.get_tanks_position()[0][0] - 3) / EPS) + (round((self.get_tanks_position()[0][1] - 3) / EPS) + 1) * WIDTH] = 1
-        self.map_track[round((self.get_tanks_position()[0][0] - 3) / EPS) + 1 + round((self.get_tanks_position()[0][1] - 3) / EPS) * WIDTH] = 1
-        self.map_track[round((self.get_tanks_position()[0][0] - 3) / EPS) + 1 + (round((self.get_tanks_position()[0][1] - 3) / EPS) + 1) * WIDTH] = 1
-        self.pre_null, self.after_null = list.count(self.map_track, 0), list.count(self.map_track, 0)
+        self._track_tank(round((self.get_tanks_position()[0][0] - 3) / EPS), round((self.get_tanks_position()[0][1] - 3) / EPS), 1)
+        self.pre_null = self.after_null = len(self.map_track) - self.track_visited
 
     def _get_reward(self):
         """
@@ -270,15 +413,12 @@ class Environment(tanks.Game):
         reward = 0
         # 当坦克到达全新位置，对其进行奖励，随着未到达地区减少奖励增加
         if self.pre_null != self.after_null:
-            reward = reward + list.count(self.map_track,1)#abs(self.pre_null - self.after_null) *
-        flag = 0
+            reward = reward + self.track_visited#abs(self.pre_null - self.after_null) *
         # # 判断当前位置是否和前二十步位置重合
-        for s in self.laststate:
-            if s[0] == curpos[0] and s[1] == curpos[1]:
-                flag += 1
+        flag = self.laststate_counts.get(curpos, 0)
         if flag == 0:
-            for s in self.laststate:
-                reward = reward + abs(s[0] - curpos[0]) + abs(s[1] - curpos[1]) - 10
+            window = self.laststate[:self.laststate_len]
+            reward = reward + int(np.abs(window - curpos).sum()) - 10 * self.laststate_len
             # 只有不重复的位置才被记录，防止坦克原地不动
             # self.laststate.append(curpos)
         else:
@@ -287,16 +427,29 @@ class Environment(tanks.Game):
         #         reward = reward - (abs(s[0] - curpos[0]) + abs(s[1] - curpos[1])) / 2
         # reward = reward + abs(l[0] - curpos[0]) - 5
         # reward = reward + abs(l[1] - curpos[1]) - 5
-        self.laststate.append(curpos)
-        while len(self.laststate) > 1200:#200
-            first = self.laststate.pop(0)
-            self.map_track[round(first[0] / EPS) + round(first[1] / EPS) * WIDTH] = 0
-            self.map_track[round(first[0] / EPS) + 1 + round(first[1] / EPS) * WIDTH] = 0
-            self.map_track[round(first[0] / EPS) + (round(first[1] / EPS) + 1) * WIDTH] = 0
-            self.map_track[round(first[0] / EPS) + 1 + (round(first[1] / EPS) + 1) * WIDTH] = 0
+        self._remember(curpos)
 
         return reward
 
+    def _remember(self, pos):
+        """
+        把坦克位置写入 laststate 环形缓冲区，缓冲区已满时覆盖最早的位置，并把该位置占用的格子重新标记为未到达
+
+        :param pos: (int, int), 修正后的坦克像素坐标
+        """
+        i = self.laststate_next
+        if self.laststate_len == HISTORY:
+            first = (int(self.laststate[i, 0]), int(self.laststate[i, 1]))
+            self.laststate_counts[first] -= 1
+            if not self.laststate_counts[first]:
+                del self.laststate_counts[first]
+            self._track_tank(round(first[0] / EPS), round(first[1] / EPS), 0)
+        else:
+            self.laststate_len += 1
+        self.laststate[i] = pos
+        self.laststate_counts[pos] = self.laststate_counts.get(pos, 0) + 1
+        self.laststate_next = (i + 1) % HISTORY
+
     def _get_state(self):
         """
         你需要填补这一部分的内容，你的主要时间（50%+） 应该用于修改这个函数
@@ -362,5 +515,5 @@ if __name__ == '__main__':
     print(en.get_tanks_position())
     print(en.laststate[0])
     print(1 & 0, 0 & 0, 1 & 1)
-    print(list.count(en.map_track,2))
+    print(en.map_track.count(2))
     print(2 & 2)
\ No newline at end of file
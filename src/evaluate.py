@@ -0,0 +1,301 @@
+import argparse
+import csv
+import glob
+import json
+import os
+import re
+import time
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+import environment as Env
+from checkpoint import load_agent
+
+
+def _visit(env, visited):
+    """
+    把玩家坦克当前占用的格子加入 visited，格子的算法同 environment.Environment._tick
+    """
+    x, y = env.get_tanks_position()[0]
+    x, y = round((x - 3) / Env.EPS), round((y - 3) / Env.EPS)
+    visited.update(((x, y), (x + 1, y), (x, y + 1), (x + 1, y + 1)))
+
+
+def run_greedy_episode(env, agent, seed, max_step=1024, repeat=8):
+    """
+    用给定的种子重置环境，每一步选择概率最大的动作玩一局游戏，不收集训练数据
+
+    :param env: 虚拟环境
+    :param agent: 强化学习智能体
+    :param seed: int, 环境的随机数种子，种子相同时同一个智能体得到的结果完全相同
+    :param max_step: int, 与环境交互的最大次数
+    :param repeat: int, 每个动作在环境中重复执行的帧数，与训练时相同
+    :return: dict
+    seed: int, 本局游戏的种子
+    return: float, 本局游戏的总奖励数（按帧平均，与训练时的记录相同）
+    coverage: float, 本局到达过的格子占地图上非铁块格子的比例（每一步结束时记录坦克占用的 2*2 个格子）
+    kills: int, 本局游戏中被击杀的敌人数量
+    length: int, 本局游戏的时长
+    done: bool, 本局游戏是否结束
+    steps_per_sec: float, 每秒与环境交互的次数
+    actions: list of int, 每一步的动作，可用于回放
+    """
+    spec = env.get_observation_spec()
+    obs = np.empty((max_step + 1,) + spec['shape'], dtype=spec['dtype'])
+    actions = []
+    ep_ret = 0
+    # env.map_track 只记录最近 HISTORY 帧到达的格子，这里另外记录整局游戏到达过的格子
+    visited = set()
+    t = time.perf_counter()
+    env._reset(seed=seed, out=obs[0])
+    _visit(env, visited)
+    while True:
+        step = len(actions)
+        with torch.no_grad():
+            act = agent.logits_net(torch.from_numpy(obs[step])).argmax().item()
+        _, rew, done = env.step(act, repeat=repeat, out=obs[step + 1])
+        ep_ret += rew
+        actions.append(act)
+        _visit(env, visited)
+        if done or len(actions) >= max_step:
+            break
+    elapsed = time.perf_counter() - t
+
+    free = Env.WIDTH * Env.HEIGHT - len(env.get_steel_position())
+    return {
+        'seed': seed,
+        'return': ep_ret,
+        'coverage': len(visited) / free,
+        'kills': env.get_killed_nums()[1],
+        'length': len(actions),
+        'done': bool(done),
+        'steps_per_sec': len(actions) / max(elapsed, 1e-9),
+        'actions': actions,
+    }
+
+
+def summarize(episodes):
+    """
+    汇总多局游戏的结果
+
+    :param episodes: list of dict, run_greedy_episode 的返回值
+    :return: dict, 各项指标的均值，return 另有标准差
+    """
+    summary = {key: float(np.mean([ep[key] for ep in episodes]))
+               for key in ('return', 'coverage', 'kills', 'length', 'steps_per_sec')}
+    summary['return_std'] = float(np.std([ep['return'] for ep in episodes]))
+    summary['episodes'] = len(episodes)
+    return summary
+
+
+def save_recording(path, checkpoint, episode, enemy_num, repeat):
+    """
+    把一局游戏的动作序列写入 json 文件，环境是确定性的，回放时用同样的种子重新执行这些动作即可
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({'checkpoint': checkpoint, 'seed': episode['seed'], 'enemy_num': enemy_num, 'repeat': repeat,
+                   'actions': episode['actions']}, f)
+
+
+def replay(path, quick=5):
+    """
+    显示画面，回放 save_recording 保存的一局游戏
+
+    :param path: str, 录像文件
+    :param quick: int, 同 tanks.quick
+    """
+    import tanks
+    with open(path) as f:
+        record = json.load(f)
+    # 固定每帧的时间，才能与不显示画面时的轨迹相同
+    env = Env.Environment(show=1, debug=0, enemy_num=record['enemy_num'], seed=record['seed'], dt=Env.TICK)
+    tanks.quick = quick
+    env._reset(seed=record['seed'])
+    for act in record['actions']:
+        env.step(act, repeat=record['repeat'])
+
+
+def _checkpoint_step(path):
+    return int(re.search(r'ckpt_(\d+)\.pt$', path).group(1))
+
+
+def _eval_loop(directory, stop, num_episodes, seed, enemy_num, max_step, repeat, every, record, poll_seconds):
+    """
+    评估进程的主循环：定期查看目录中最新的检查点，比上次评估的检查点新至少 every 轮时评估一次
+    结果打印出来并追加到 directory/eval.jsonl，record 为 True 时录像保存在 directory/recordings/
+    """
+    torch.set_num_threads(1)
+    env = Env.Environment(show=0, debug=0, enemy_num=enemy_num)
+    seeds = [seed + i for i in range(num_episodes)]
+    last_step = None
+
+    while not stop.wait(poll_seconds):
+        paths = glob.glob(os.path.join(directory, 'ckpt_*.pt'))
+        if not paths:
+            continue
+        path = max(paths, key=_checkpoint_step)
+        step = _checkpoint_step(path)
+        if last_step is not None and step < last_step + every:
+            continue
+        try:
+            agent = load_agent(path)
+        except FileNotFoundError:
+            # 检查点刚好被 CheckpointManager 删除，等下一个
+            continue
+        last_step = step
+
+        episodes = []
+        for s in seeds:
+            episodes.append(run_greedy_episode(env, agent, s, max_step=max_step, repeat=repeat))
+            if stop.is_set():
+                return
+        summary = summarize(episodes)
+        summary['step'] = step
+        summary['checkpoint'] = os.path.basename(path)
+        print(f'eval {summary["checkpoint"]}: return {summary["return"]:.1f} ± {summary["return_std"]:.1f}, '
+              f'coverage {summary["coverage"]:.3f}, kills {summary["kills"]:.2f}, length {summary["length"]:.1f}')
+        with open(os.path.join(directory, 'eval.jsonl'), 'a') as f:
+            f.write(json.dumps(summary) + '\n')
+        if record:
+            for ep in episodes:
+                save_recording(os.path.join(directory, 'recordings', f'ckpt_{step}_seed{ep["seed"]}.json'),
+                               summary['checkpoint'], ep, enemy_num, repeat)
+
+
+# 各任务的环境设置，与 train.train 相同
+TASKS = {
+    'explore': {'enemy_num': 0, 'max_step': 1024},
+    'play': {'enemy_num': 5, 'max_step': 1024 * 2},
+}
+# 排名表的列
+RANK_FIELDS = ['rank', 'checkpoint', 'step', 'return', 'return_std', 'coverage', 'kills', 'length', 'steps_per_sec',
+               'episodes']
+
+_env = None
+
+
+def _init_rank_worker(enemy_num):
+    global _env
+    torch.set_num_threads(1)
+    _env = Env.Environment(show=0, debug=0, enemy_num=enemy_num)
+
+
+def _evaluate_checkpoint(args):
+    path, seeds, max_step, repeat = args
+    agent = load_agent(path)
+    summary = summarize([run_greedy_episode(_env, agent, s, max_step=max_step, repeat=repeat) for s in seeds])
+    summary['checkpoint'] = os.path.basename(path)
+    summary['step'] = int(re.search(r'(\d+)', summary['checkpoint']).group(1))
+    return summary
+
+
+def rank_checkpoints(paths, seeds, enemy_num=20, max_step=1024, repeat=8, processes=None, key='return'):
+    """
+    用多个进程评估一批检查点，每个检查点用同样的种子各玩一局游戏，按 key 的均值从高到低排名
+
+    :param paths: list of str, 检查点（ckpt_*.pt）或旧版本的 log_*.pkl
+    :param seeds: list of int, 每个检查点评估的游戏种子
+    :param enemy_num: int, 一共会刷新多少个敌方坦克
+    :param max_step: int, 一局游戏中与环境交互的最大次数
+    :param repeat: int, 每个动作在环境中重复执行的帧数
+    :param processes: None/int, 进程数，默认等于 CPU 数
+    :param key: str, 排名依据的指标，见 summarize
+    :return: list of dict, 排好序的结果，字段见 RANK_FIELDS
+    """
+    ctx = mp.get_context('spawn')
+    with ctx.Pool(processes, initializer=_init_rank_worker, initargs=(enemy_num,)) as pool:
+        results = pool.map(_evaluate_checkpoint, [(path, seeds, max_step, repeat) for path in paths], chunksize=1)
+    results.sort(key=lambda summary: (-summary[key], summary['step']))
+    for i, summary in enumerate(results):
+        summary['rank'] = i + 1
+    return results
+
+
+def write_ranking(results, csv_path=None, json_path=None):
+    """
+    把 rank_checkpoints 的结果写成 csv 和/或 json 文件
+    """
+    if csv_path:
+        with open(csv_path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=RANK_FIELDS)
+            writer.writeheader()
+            writer.writerows({field: summary[field] for field in RANK_FIELDS} for summary in results)
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump([{field: summary[field] for field in RANK_FIELDS} for summary in results], f, indent=1)
+
+
+class EvalWorker:
+    """
+    在单独的进程中评估训练过程中保存的检查点
+
+    评估进程自己查看目录中最新的检查点，不与训练进程通信，训练循环不会因为评估而等待，
+    训练用的环境也不会被打断。每次评估用固定的种子、不显示画面、选择概率最大的动作玩 num_episodes 局游戏，
+    记录回报、地图探索比例、击杀数和时长。需要观看时可以保存录像，之后用 python evaluate.py replay 录像文件 回放。
+    """
+
+    def __init__(self, directory, num_episodes=3, seed=0, enemy_num=20, max_step=1024, repeat=8, every=1,
+                 record=False, poll_seconds=1.0):
+        """
+        :param directory: str, CheckpointManager 保存检查点的目录
+        :param num_episodes: int, 每个检查点评估几局游戏，第 i 局的种子为 seed + i
+        :param seed: int, 第一局游戏的种子
+        :param enemy_num: int, 一共会刷新多少个敌方坦克
+        :param max_step: int, 一局游戏中与环境交互的最大次数
+        :param repeat: int, 每个动作在环境中重复执行的帧数
+        :param every: int, 检查点比上次评估的检查点新至少这么多轮时才评估
+        :param record: bool, 是否保存每局游戏的录像
+        :param poll_seconds: float, 每隔多少秒查看一次目录
+        """
+        ctx = mp.get_context('spawn')
+        self.stop = ctx.Event()
+        self.proc = ctx.Process(
+            target=_eval_loop,
+            args=(directory, self.stop, num_episodes, seed, enemy_num, max_step, repeat, every, record, poll_seconds),
+            daemon=True,
+        )
+        self.proc.start()
+
+    def close(self):
+        """
+        通知评估进程在当前这局游戏结束后退出
+        """
+        self.stop.set()
+        self.proc.join()
+
+
+if __name__ == '__main__':
+    # python evaluate.py rank explore --seeds 5
+    # python evaluate.py replay logs/explore/recordings/ckpt_100_seed0.json
+    parser = argparse.ArgumentParser(description='评估检查点')
+    commands = parser.add_subparsers(dest='command', required=True)
+    rank_parser = commands.add_parser('rank', help='评估 logs/{task} 中的全部检查点并排名')
+    rank_parser.add_argument('task', choices=sorted(TASKS))
+    rank_parser.add_argument('--pattern', default='log_*.pkl', help='检查点的文件名模式，例如 ckpt_*.pt')
+    rank_parser.add_argument('--seeds', type=int, default=3, help='每个检查点评估几局游戏，种子为 0, 1, ...')
+    rank_parser.add_argument('--processes', type=int, default=None)
+    rank_parser.add_argument('--key', default='return', choices=['return', 'coverage', 'kills'], help='排名依据')
+    rank_parser.add_argument('--csv', default=None, help='默认为 logs/{task}/ranking.csv')
+    rank_parser.add_argument('--json', default=None, help='默认为 logs/{task}/ranking.json')
+    replay_parser = commands.add_parser('replay', help='显示画面回放录像')
+    replay_parser.add_argument('paths', nargs='+')
+    args = parser.parse_args()
+
+    if args.command == 'replay':
+        for path in args.paths:
+            replay(path)
+    else:
+        directory = f'logs/{args.task}'
+        paths = glob.glob(os.path.join(directory, args.pattern))
+        t = time.time()
+        results = rank_checkpoints(paths, list(range(args.seeds)), key=args.key, processes=args.processes,
+                                   **TASKS[args.task])
+        write_ranking(results, args.csv or os.path.join(directory, 'ranking.csv'),
+                      args.json or os.path.join(directory, 'ranking.json'))
+        print(f'评估了 {len(results)} 个检查点，用时 {time.time() - t:.1f} 秒')
+        for summary in results[:10]:
+            print(f'{summary["rank"]:>3} {summary["checkpoint"]:<16} return {summary["return"]:.1f} '
+                  f'± {summary["return_std"]:.1f}, coverage {summary["coverage"]:.3f}, kills {summary["kills"]:.2f}')
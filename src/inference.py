@@ -0,0 +1,118 @@
+import queue
+import threading
+import time
+from collections import Counter
+
+import torch
+from torch.distributions.categorical import Categorical
+
+
+class InferenceServer:
+    """
+    批量推理服务
+
+    多个线程各自驱动一个环境，通过 choose_action 提交状态并等待动作。
+    服务线程把同时等待的请求拼成一批，只做一次前向计算和一次 Categorical 采样，再把动作分发回去。
+    凑满 max_batch 个请求，或者距离这一批的第一个请求已过去 max_wait 秒时立即计算。
+    choose_action 与 AgentVPG.choose_action 的用法相同，因此可以直接传给 run_one_episode。
+    """
+
+    def __init__(self, policy, obs_dim, max_batch=8, max_wait=0.002):
+        """
+        :param policy: nn.Module, 输入状态输出各动作的 logits，例如 agent.logits_net，
+            参数可以在两轮收集之间原地更新
+        :param obs_dim: int, 状态的维度
+        :param max_batch: int, 一批最多的请求数，通常等于使用服务的线程数
+        :param max_wait: float, 一批请求最多等待的秒数
+        """
+        self.policy = policy
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self._obs = torch.zeros(max_batch, obs_dim)
+        self.reset_stats()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def choose_action(self, obs):
+        """
+        提交一个状态，阻塞到服务线程给出动作
+        :param obs: tensor/numpy.ndarray, (obs_dim,)
+        :return: int, 动作
+        """
+        reply = {'event': threading.Event(), 'time': time.perf_counter()}
+        self.requests.put((obs, reply))
+        reply['event'].wait()
+        return reply['act']
+
+    def _serve(self):
+        """
+        服务线程的主循环，收到 None 时退出
+        """
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            pending = [request]
+            deadline = time.perf_counter() + self.max_wait
+            closing = False
+            while len(pending) < self.max_batch:
+                timeout = deadline - time.perf_counter()
+                try:
+                    request = self.requests.get(timeout=timeout) if timeout > 0 else self.requests.get_nowait()
+                except queue.Empty:
+                    break
+                if request is None:
+                    closing = True
+                    break
+                pending.append(request)
+
+            n = len(pending)
+            for i, (obs, _) in enumerate(pending):
+                self._obs[i] = torch.as_tensor(obs)
+            with torch.no_grad():
+                acts = Categorical(logits=self.policy(self._obs[:n])).sample().tolist()
+
+            now = time.perf_counter()
+            for (_, reply), act in zip(pending, acts):
+                reply['act'] = act
+                self.latency += now - reply['time']
+                reply['event'].set()
+            self.num_requests += n
+            self.num_batches += 1
+            self.batch_sizes[n] += 1
+            if closing:
+                return
+
+    def get_stats(self):
+        """
+        自上次 reset_stats 以来的统计信息
+
+        :return: dict
+        requests: int, 处理的请求数
+        batches: int, 前向计算的次数
+        mean_batch_size: float, 平均每批的请求数
+        batch_sizes: dict, 每种批大小出现的次数
+        throughput: float, 每秒处理的请求数
+        mean_latency: float, 请求从提交到得到动作的平均秒数
+        """
+        elapsed = time.perf_counter() - self.start_time
+        return {
+            'requests': self.num_requests,
+            'batches': self.num_batches,
+            'mean_batch_size': self.num_requests / max(self.num_batches, 1),
+            'batch_sizes': dict(sorted(self.batch_sizes.items())),
+            'throughput': self.num_requests / max(elapsed, 1e-9),
+            'mean_latency': self.latency / max(self.num_requests, 1),
+        }
+
+    def reset_stats(self):
+        self.start_time = time.perf_counter()
+        self.num_requests = 0
+        self.num_batches = 0
+        self.batch_sizes = Counter()
+        self.latency = 0.0
+
+    def close(self):
+        self.requests.put(None)
+        self._thread.join()
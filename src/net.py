@@ -31,3 +31,15 @@ class MLP(nn.Module):
         # state = self.cnn(state.view(b_s, 1, 15, 15))
         out = self.mlp(state)
         return out
+
+
+class ValueNet(MLP):
+    """
+    critic, estimates the value of a state with the same body as MLP
+    """
+
+    def __init__(self, input_dim, hidden_dim=32):
+        super(ValueNet, self).__init__(input_dim, 1, hidden_dim)
+
+    def forward(self, state):
+        return self.mlp(state).squeeze(-1)
@@ -0,0 +1,56 @@
+import numpy as np
+import torch
+
+
+def discounted_returns(rews, dones=None, gamma=0.9, last_value=None):
+    """
+    计算折扣回报 G[t] = r[t] + gamma * G[t+1]，在 float32 下按时间倒序扫描一遍，
+    每一步同时处理所有并列的轨迹（例如多个环境各占一列），
+    与 train.reward_to_go 逐个元素计算的结果完全相同
+
+    :param rews: list/numpy.ndarray/tensor, (T,) 或 (T, N)，每一步的奖励
+    :param dones: None/同 rews 形状, 第 t 步是一局游戏的最后一步时为 1，回报不会跨过这一步传递，
+        因此多局游戏可以首尾相接放在同一列中一起计算
+    :param gamma: float, 折扣因子
+    :param last_value: None/float/(N,), 最后一步之后的回报估计（未结束的轨迹用于自举），默认为 0
+    :return: tensor, float32，形状同 rews
+    """
+    rews = np.asarray(rews, dtype=np.float32)
+    rets = np.empty_like(rews)
+    if len(rews) == 0:
+        return torch.from_numpy(rets)
+    not_done = None if dones is None else 1 - np.asarray(dones, dtype=np.float32)
+    gamma = np.float32(gamma)
+    running = np.zeros_like(rews[0]) if last_value is None else np.asarray(last_value, dtype=np.float32)
+    for t in reversed(range(len(rews))):
+        if not_done is not None:
+            running = gamma * running * not_done[t]
+        else:
+            running = gamma * running
+        running = rews[t] + running
+        rets[t] = running
+    return torch.from_numpy(rets)
+
+
+def gae(rews, values, dones, gamma=0.9, lam=0.95):
+    """
+    广义优势估计（GAE）：先求每一步的 TD 误差 delta[t] = r[t] + gamma * V[t+1] - V[t]，
+    再以 gamma * lam 为折扣因子对 delta 求折扣回报，一局游戏的最后一步之后 V 记为 0
+
+    :param rews: (T,) 或 (T, N)，每一步的奖励
+    :param values: 同 rews 形状，价值网络对每一步状态的估计
+    :param dones: 同 rews 形状，第 t 步是一局游戏的最后一步时为 1
+    :param gamma: float, 折扣因子
+    :param lam: float, GAE 的 lambda，0 时为一步 TD 误差，1 时为回报减去价值
+    :return:
+    advantages: tensor, float32, 优势估计
+    returns: tensor, float32, advantages + values，用作价值网络的目标
+    """
+    rews = np.asarray(rews, dtype=np.float32)
+    values = np.asarray(values, dtype=np.float32)
+    not_done = 1 - np.asarray(dones, dtype=np.float32)
+    next_values = np.zeros_like(values)
+    next_values[:-1] = values[1:]
+    deltas = rews + np.float32(gamma) * next_values * not_done - values
+    advantages = discounted_returns(deltas, dones, gamma=gamma * lam)
+    return advantages, advantages + torch.from_numpy(values)
@@ -1,7 +1,7 @@
 #!/usr/bin/python
 # coding=utf-8
 
-import os, pygame, time, random, uuid, sys
+import os, pygame, time, random, sys, glob, pickle, heapq
 
 
 class myRect(pygame.Rect):
@@ -11,44 +11,126 @@ class myRect(pygame.Rect):
 		self.type = type
 
 
+def getImage(world, rect, angle = 0):
+	""" Image cut from the sprite atlas and rotated, cached for the whole process
+	so every tank, bullet and tile shares the same surfaces instead of cutting
+	and rotating its own copy
+	@param World world Owner of the object asking, headless worlds get None
+	@param tuple rect (x, y, width, height) in the atlas
+	@param int angle Counterclockwise rotation in degrees
+	@return pygame.Surface
+	"""
+	global sprites, images
+	if world.headless:
+		return None
+	key = (rect, angle)
+	image = images.get(key)
+	if image is None:
+		image = sprites.subsurface(rect)
+		if angle:
+			image = pygame.transform.rotate(image, angle)
+		images[key] = image
+	return image
+
+def getDirectionImages(world, rect):
+	""" Image facing each direction, indexed by DIR_UP, DIR_RIGHT, DIR_DOWN, DIR_LEFT
+	@return list
+	"""
+	return [getImage(world, rect, angle) for angle in (0, 270, 180, 90)]
+
+
 class Timer(object):
+	""" Schedules callbacks in game time
+	Pending runs are kept in a heap ordered by due time, so a frame only touches
+	the timers that actually fire, and adding or destroying a timer is O(log n).
+	Timers due at the same time fire in the order they were added.
+	A timer added by a callback counts from the start of the frame being updated, as if
+	it had been added just before that frame (the old list based timer advanced such timers
+	in the same frame, and seeded games depend on that) """
+
 	def __init__(self):
-		self.timers = []
+		self.clear()
+
+	def clear(self):
+		""" Destroy all timers and restart game time """
+		self.time = 0
+		# time new timers count from, the start of the frame while update() runs callbacks
+		self.start = 0
+		# heap of (due time, handle, remaining runs), at most one live entry per handle
+		self.queue = []
+		# handle => (interval, callback), destroyed timers are dropped from here
+		# and their queue entries are skipped when they come up
+		self.timers = {}
+		self.next_handle = 0
 
 	def add(self, interval, f, repeat = -1):
-		options = {
-			"interval"	: interval,
-			"callback"	: f,
-			"repeat"		: repeat,
-			"times"			: 0,
-			"time"			: 0,
-			"uuid"			: uuid.uuid4()
-		}
-		self.timers.append(options)
-
-		return options["uuid"]
+		""" Call f every interval ms
+		@param int interval Milliseconds between calls
+		@param callable f Callback, a timer whose callback raises is destroyed
+		@param int repeat Number of calls before the timer is destroyed, -1 for no limit
+		@return int Handle for destroy()
+		"""
+		handle = self.next_handle
+		self.next_handle += 1
+		self.timers[handle] = (interval, f)
+		heapq.heappush(self.queue, (self.start + interval, handle, repeat))
+		return handle
 
-	def destroy(self, uuid_nr):
-		for timer in self.timers:
-			if timer["uuid"] == uuid_nr:
-				self.timers.remove(timer)
-				return
+	def destroy(self, handle):
+		""" Stop timer, unknown or already finished handles are ignored """
+		self.timers.pop(handle, None)
 
 	def update(self, time_passed):
-		for timer in self.timers:
-			timer["time"] += time_passed
-			if timer["time"] > timer["interval"]:
-				timer["time"] -= timer["interval"]
-				timer["times"] += 1
-				if timer["repeat"] > -1 and timer["times"] == timer["repeat"]:
-					self.timers.remove(timer)
-				try:
-					timer["callback"]()
-				except:
-					try:
-						self.timers.remove(timer)
-					except:
-						pass
+		""" Advance game time and fire every timer that came due
+		A long frame fires a timer as many times as its interval fits in it
+		"""
+		self.start = self.time
+		self.time += time_passed
+		queue = self.queue
+		while queue and queue[0][0] < self.time:
+			due, handle, repeat = heapq.heappop(queue)
+			timer = self.timers.get(handle)
+			if timer is None:
+				continue
+			interval, callback = timer
+			if repeat == 1:
+				del self.timers[handle]
+			else:
+				# a zero interval still has to move forward, or the loop would never end
+				heapq.heappush(queue, (due + max(interval, 1), handle, repeat - 1 if repeat > 0 else repeat))
+			try:
+				callback()
+			except Exception:
+				self.timers.pop(handle, None)
+		self.start = self.time
+
+
+class World():
+	""" Everything that lives on the map: tanks, bullets, bonuses, labels, the castle
+	and the timer driving them. Each game owns its own world, so several games can
+	run side by side in one process.
+	A headless world is pure game logic: no images are cut, rotated or rendered.
+	All game randomness comes from the world's own random.Random, pass rng to make
+	a game reproducible """
+
+	def __init__(self, headless = False, rng = None):
+		self.headless = headless
+		self.random = random.Random() if rng is None else rng
+		self.players = []
+		self.enemies = []
+		self.bullets = []
+		self.bonuses = []
+		self.labels = []
+		self.timer = Timer()
+		self.castle = None
+
+	def clear(self):
+		""" Remove everything but players and castle """
+		del self.bullets[:]
+		del self.enemies[:]
+		del self.bonuses[:]
+		del self.labels[:]
+		self.timer.clear()
 
 
 class Castle():
@@ -56,13 +138,15 @@ class Castle():
 
 	(STATE_STANDING, STATE_DESTROYED, STATE_EXPLODING) = range(3)
 
-	def __init__(self):
+	def __init__(self, world):
 
 		global sprites
 
+		self.world = world
+
 		# images
-		self.img_undamaged = sprites.subsurface(0, 15*2, 16*2, 16*2)
-		self.img_destroyed = sprites.subsurface(16*2, 15*2, 16*2, 16*2)
+		self.img_undamaged = getImage(world, (0, 15*2, 16*2, 16*2))
+		self.img_destroyed = getImage(world, (16*2, 15*2, 16*2, 16*2))
 
 		# init position
 		self.rect = pygame.Rect(12*16, 24*16, 32, 32)
@@ -92,7 +176,7 @@ class Castle():
 	def destroy(self):
 		""" Destroy castle """
 		self.state = self.STATE_EXPLODING
-		self.explosion = Explosion(self.rect.topleft)
+		self.explosion = Explosion(self.world, self.rect.topleft)
 		self.image = self.img_destroyed
 		self.active = False
 
@@ -113,10 +197,12 @@ class Bonus():
 	# bonus types
 	(BONUS_GRENADE, BONUS_HELMET, BONUS_SHOVEL, BONUS_STAR, BONUS_TANK, BONUS_TIMER) = range(6)
 
-	def __init__(self, level):
+	def __init__(self, world, level):
 
 		global sprites
 
+		self.world = world
+
 		# to know where to place
 		self.level = level
 
@@ -126,9 +212,9 @@ class Bonus():
 		# blinking state
 		self.visible = True
 
-		self.rect = pygame.Rect(random.randint(0, 416-32), random.randint(0, 416-32), 32, 32)
+		self.rect = pygame.Rect(world.random.randint(0, 416-32), world.random.randint(0, 416-32), 32, 32)
 
-		self.bonus = random.choice([
+		self.bonus = world.random.choice([
 			self.BONUS_GRENADE,
 			self.BONUS_HELMET,
 			self.BONUS_SHOVEL,
@@ -137,7 +223,7 @@ class Bonus():
 			self.BONUS_TIMER
 		])
 
-		self.image = sprites.subsurface(16*2*self.bonus, 32*2, 16*2, 15*2)
+		self.image = getImage(world, (16*2*self.bonus, 32*2, 16*2, 15*2))
 
 	def draw(self):
 		""" draw bonus """
@@ -159,10 +245,11 @@ class Bullet():
 
 	(OWNER_PLAYER, OWNER_ENEMY) = range(2)
 
-	def __init__(self, level, position, direction, damage = 100, speed = 5):
+	def __init__(self, world, level, position, direction, damage = 100, speed = 5):
 
 		global sprites
 
+		self.world = world
 		self.level = level
 		self.direction = direction
 		self.damage = damage
@@ -173,25 +260,22 @@ class Bullet():
 		# 2-can destroy steel
 		self.power = 1
 
-		self.image = sprites.subsurface(75*2, 74*2, 3*2, 4*2)
-
 		# position is player's top left corner, so we'll need to
-		# recalculate a bit. also rotate image itself.
+		# recalculate a bit.
 		if direction == self.DIR_UP:
 			self.rect = pygame.Rect(position[0] + 11, position[1] - 8, 6, 8)
 		elif direction == self.DIR_RIGHT:
-			self.image = pygame.transform.rotate(self.image, 270)
 			self.rect = pygame.Rect(position[0] + 26, position[1] + 11, 8, 6)
 		elif direction == self.DIR_DOWN:
-			self.image = pygame.transform.rotate(self.image, 180)
 			self.rect = pygame.Rect(position[0] + 11, position[1] + 26, 6, 8)
 		elif direction == self.DIR_LEFT:
-			self.image = pygame.transform.rotate(self.image, 90)
 			self.rect = pygame.Rect(position[0] - 8 , position[1] + 11, 8, 6)
 
+		self.image = getDirectionImages(world, (75*2, 74*2, 3*2, 4*2))[direction]
+
 		self.explosion_images = [
-			sprites.subsurface(0, 80*2, 32*2, 32*2),
-			sprites.subsurface(32*2, 80*2, 32*2, 32*2),
+			getImage(world, (0, 80*2, 32*2, 32*2)),
+			getImage(world, (32*2, 80*2, 32*2, 32*2)),
 		]
 
 		self.speed = speed
@@ -207,7 +291,7 @@ class Bullet():
 			self.explosion.draw()
 
 	def update(self):
-		global castle, players, enemies, bullets
+		world = self.world
 
 		if self.state == self.STATE_EXPLODING:
 			if not self.explosion.active:
@@ -251,40 +335,37 @@ class Bullet():
 
 		# check for collisions with walls. one bullet can destroy several (1 or 2)
 		# tiles but explosion remains 1
-		rects = self.level.obstacle_rects
-		collisions = self.rect.collidelistall(rects)
-		if collisions != []:
-			for i in collisions:
-				if self.level.hitTile(rects[i].topleft, self.power, self.owner == self.OWNER_PLAYER):
-					has_collided = True
+		for tile in self.level.collideObstacles(self.rect):
+			if self.level.hitTile(tile.topleft, self.power, self.owner == self.OWNER_PLAYER):
+				has_collided = True
 		if has_collided:
 			self.explode()
 			return
 
 		# check for collisions with other bullets
-		for bullet in bullets:
+		for bullet in world.bullets:
 			if self.state == self.STATE_ACTIVE and bullet.owner != self.owner and bullet != self and self.rect.colliderect(bullet.rect):
 				self.destroy()
 				self.explode()
 				return
 
 		# check for collisions with players
-		for player in players:
+		for player in world.players:
 			if player.state == player.STATE_ALIVE and self.rect.colliderect(player.rect):
 				if player.bulletImpact(self.owner == self.OWNER_PLAYER, self.damage, self.owner_class):
 					self.destroy()
 					return
 
 		# check for collisions with enemies
-		for enemy in enemies:
+		for enemy in world.enemies:
 			if enemy.state == enemy.STATE_ALIVE and self.rect.colliderect(enemy.rect):
 				if enemy.bulletImpact(self.owner == self.OWNER_ENEMY, self.damage, self.owner_class):
 					self.destroy()
 					return
 
 		# check for collision with castle
-		if castle.active and self.rect.colliderect(castle.rect):
-			castle.destroy()
+		if world.castle.active and self.rect.colliderect(world.castle.rect):
+			world.castle.destroy()
 			self.destroy()
 			return
 
@@ -293,14 +374,14 @@ class Bullet():
 		global screen
 		if self.state != self.STATE_REMOVED:
 			self.state = self.STATE_EXPLODING
-			self.explosion = Explosion([self.rect.left-13, self.rect.top-13], None, self.explosion_images)
+			self.explosion = Explosion(self.world, [self.rect.left-13, self.rect.top-13], None, self.explosion_images)
 
 	def destroy(self):
 		self.state = self.STATE_REMOVED
 
 
 class Label():
-	def __init__(self, position, text = "", duration = None):
+	def __init__(self, world, position, text = "", duration = None):
 
 		self.position = position
 
@@ -308,10 +389,10 @@ class Label():
 
 		self.text = text
 
-		self.font = pygame.font.SysFont("Arial", 13)
+		self.font = None if world.headless else pygame.font.SysFont("Arial", 13)
 
 		if duration != None:
-			gtimer.add(duration, lambda :self.destroy(), 1)
+			world.timer.add(duration, lambda :self.destroy(), 1)
 
 	def draw(self):
 		""" draw label """
@@ -323,7 +404,7 @@ class Label():
 
 
 class Explosion():
-	def __init__(self, position, interval = None, images = None):
+	def __init__(self, world, position, interval = None, images = None):
 
 		global sprites
 
@@ -335,18 +416,17 @@ class Explosion():
 
 		if images == None:
 			images = [
-				sprites.subsurface(0, 80*2, 32*2, 32*2),
-				sprites.subsurface(32*2, 80*2, 32*2, 32*2),
-				sprites.subsurface(64*2, 80*2, 32*2, 32*2)
+				getImage(world, (0, 80*2, 32*2, 32*2)),
+				getImage(world, (32*2, 80*2, 32*2, 32*2)),
+				getImage(world, (64*2, 80*2, 32*2, 32*2))
 			]
 
-		images.reverse()
-
-		self.images = [] + images
+		# reversed copy, the caller's list may be shared
+		self.images = images[::-1]
 
 		self.image = self.images.pop()
 
-		gtimer.add(interval, lambda :self.update(), len(self.images) + 1)
+		world.timer.add(interval, lambda :self.update(), len(self.images) + 1)
 
 	def draw(self):
 		global screen
@@ -369,24 +449,41 @@ class Level():
 	# tile width/height in px
 	TILE_SIZE = 16
 
-	def __init__(self, level_nr = None):
+	# map width/height in tiles, also the size of the obstacle grid
+	GRID_CELLS = 26
+
+	# tanks cannot move over these
+	OBSTACLE_TILES = (TILE_BRICK, TILE_STEEL, TILE_WATER)
+
+	# all levels parsed ahead of time by compileLevels
+	COMPILED_FILE = "levels/compiled.pkl"
+
+	# level_nr -> (tiles, obstacle_grid), shared by every level in this process
+	cache = {}
+
+	# level_nr -> layout read from COMPILED_FILE, None until first needed
+	compiled = None
+
+	def __init__(self, world, level_nr = None):
 		""" There are total 35 different levels. If level_nr is larger than 35, loop over
 		to next according level so, for example, if level_nr ir 37, then load level 2 """
 
 		global sprites
 
+		self.world = world
+
 		# max number of enemies simultaneously  being on map
 		self.max_active_enemies = 1
 
 		tile_images = [
-			pygame.Surface((8*2, 8*2)),
-			sprites.subsurface(48*2, 64*2, 8*2, 8*2),
-			sprites.subsurface(48*2, 72*2, 8*2, 8*2),
-			sprites.subsurface(56*2, 72*2, 8*2, 8*2),
-			sprites.subsurface(64*2, 64*2, 8*2, 8*2),
-			sprites.subsurface(64*2, 64*2, 8*2, 8*2),
-			sprites.subsurface(72*2, 64*2, 8*2, 8*2),
-			sprites.subsurface(64*2, 72*2, 8*2, 8*2)
+			None if world.headless else pygame.Surface((8*2, 8*2)),
+			getImage(world, (48*2, 64*2, 8*2, 8*2)),
+			getImage(world, (48*2, 72*2, 8*2, 8*2)),
+			getImage(world, (56*2, 72*2, 8*2, 8*2)),
+			getImage(world, (64*2, 64*2, 8*2, 8*2)),
+			getImage(world, (64*2, 64*2, 8*2, 8*2)),
+			getImage(world, (72*2, 64*2, 8*2, 8*2)),
+			getImage(world, (64*2, 72*2, 8*2, 8*2))
 		]
 		self.tile_empty = tile_images[0]
 		self.tile_brick = tile_images[1]
@@ -397,21 +494,13 @@ class Level():
 		self.tile_water2= tile_images[5]
 		self.tile_froze = tile_images[6]
 
-		self.obstacle_rects = []
-
 		level_nr = 1 if level_nr == None else level_nr%35
 		if level_nr == 0:
 			level_nr = 35
 
 		self.loadLevel(level_nr)
 
-		# tiles' rects on map, tanks cannot move over
-		self.obstacle_rects = []
-
-		# update these tiles
-		self.updateObstacleRects()
-
-		gtimer.add(400, lambda :self.toggleWaves())
+		world.timer.add(400, lambda :self.toggleWaves())
 
 	def hitTile(self, pos, power = 1, sound = False):
 		"""
@@ -422,23 +511,55 @@ class Level():
 
 		global play_sounds, sounds
 
-		for tile in self.mapr:
-			if tile.topleft == pos:
-				if tile.type == self.TILE_BRICK:
-					if play_sounds and sound:
-						sounds["brick"].play()
-					self.mapr.remove(tile)
-					self.updateObstacleRects()
-					return True
-				elif tile.type == self.TILE_STEEL:
-					if play_sounds and sound:
-						sounds["steel"].play()
-					if power == 2:
-						self.mapr.remove(tile)
-						self.updateObstacleRects()
-					return True
-				else:
-					return False
+		tile = self.tiles.get((pos[0] // self.TILE_SIZE, pos[1] // self.TILE_SIZE))
+		if tile is None or tile.topleft != tuple(pos):
+			return None
+
+		if tile.type == self.TILE_BRICK:
+			if play_sounds and sound:
+				sounds["brick"].play()
+			self.removeTile(tile)
+			return True
+		elif tile.type == self.TILE_STEEL:
+			if play_sounds and sound:
+				sounds["steel"].play()
+			if power == 2:
+				self.removeTile(tile)
+			return True
+		else:
+			return False
+
+	@property
+	def mapr(self):
+		""" All tiles on map """
+		return list(self.tiles.values())
+
+	def addTile(self, x, y, type):
+		""" Put a new tile at x, y (in px), replacing the tile already there """
+		key = (x // self.TILE_SIZE, y // self.TILE_SIZE)
+		tile = myRect(x, y, self.TILE_SIZE, self.TILE_SIZE, type)
+		self.tiles.pop(key, None)
+		self.tiles[key] = tile
+		index = self.gridIndex(*key)
+		if index is not None:
+			self.obstacle_grid[index] = tile if type in self.OBSTACLE_TILES else None
+
+	def removeTile(self, tile):
+		""" Remove tile from map """
+		key = (tile.left // self.TILE_SIZE, tile.top // self.TILE_SIZE)
+		del self.tiles[key]
+		index = self.gridIndex(*key)
+		if index is not None:
+			self.obstacle_grid[index] = None
+
+	def gridIndex(self, column, row):
+		""" Index of a cell in self.obstacle_grid
+		@return int or None for cells outside the map (some level files have extra rows,
+		tiles there can never be reached, so they are left out of the grid)
+		"""
+		if 0 <= column < self.GRID_CELLS and 0 <= row < self.GRID_CELLS:
+			return row * self.GRID_CELLS + column
+		return None
 
 	def toggleWaves(self):
 		""" Toggle water image """
@@ -450,32 +571,77 @@ class Level():
 
 	def loadLevel(self, level_nr = 1):
 		""" Load specified level
+		Parsed levels are cached for the whole process, a new level only copies
+		the cached tiles and obstacle grid (tiles themselves are never modified, only
+		added to or removed from the map, so they can be shared)
 		@return boolean Whether level was loaded
 		"""
+		if level_nr not in Level.cache:
+			layout = self.readLevel(level_nr)
+			if layout is None:
+				return False
+			tiles = {}
+			for column, row, type in layout:
+				tiles[(column, row)] = myRect(column * self.TILE_SIZE, row * self.TILE_SIZE, self.TILE_SIZE, self.TILE_SIZE, type)
+			self.tiles = tiles
+			self.updateObstacleRects()
+			Level.cache[level_nr] = (tiles, self.obstacle_grid)
+
+		tiles, obstacle_grid = Level.cache[level_nr]
+		# tiles keyed by their (column, row) on map
+		self.tiles = dict(tiles)
+		self.obstacle_grid = list(obstacle_grid)
+		return True
+
+	@classmethod
+	def readLevel(cls, level_nr):
+		""" Read level layout, from the compiled levels file if there is an up to date one,
+		otherwise from the level's text file
+		@return list of (column, row, tile type) or None if there is no such level
+		"""
+		if cls.compiled is None:
+			cls.compiled = {}
+			filename = cls.COMPILED_FILE
+			if os.path.isfile(filename) and all(os.path.getmtime(filename) >= os.path.getmtime(path)
+					for path in glob.glob("levels/[0-9]*")):
+				with open(filename, "rb") as f:
+					cls.compiled = pickle.load(f)
+
+		if level_nr in cls.compiled:
+			return cls.compiled[level_nr]
+		return cls.parseLevel(level_nr)
+
+	@classmethod
+	def parseLevel(cls, level_nr):
+		""" Parse level's text file
+		@return list of (column, row, tile type) or None if there is no such level
+		"""
 		filename = "levels/"+str(level_nr)
 		if (not os.path.isfile(filename)):
-			return False
-		level = []
-		f = open(filename, "r")
-		data = f.read().split("\n")
-		self.mapr = []
-		x, y = 0, 0
-		for row in data:
-			for ch in row:
-				if ch == "#":
-					self.mapr.append(myRect(x, y, self.TILE_SIZE, self.TILE_SIZE, self.TILE_BRICK))
-				elif ch == "@":
-					self.mapr.append(myRect(x, y, self.TILE_SIZE, self.TILE_SIZE, self.TILE_STEEL))
-				elif ch == "~":
-					self.mapr.append(myRect(x, y, self.TILE_SIZE, self.TILE_SIZE, self.TILE_WATER))
-				elif ch == "%":
-					self.mapr.append(myRect(x, y, self.TILE_SIZE, self.TILE_SIZE, self.TILE_GRASS))
-				elif ch == "-":
-					self.mapr.append(myRect(x, y, self.TILE_SIZE, self.TILE_SIZE, self.TILE_FROZE))
-				x += self.TILE_SIZE
-			x = 0
-			y += self.TILE_SIZE
-		return True
+			return None
+		types = {"#": cls.TILE_BRICK, "@": cls.TILE_STEEL, "~": cls.TILE_WATER, "%": cls.TILE_GRASS, "-": cls.TILE_FROZE}
+		with open(filename, "r") as f:
+			data = f.read().split("\n")
+		layout = []
+		for row, line in enumerate(data):
+			for column, ch in enumerate(line):
+				if ch in types:
+					layout.append((column, row, types[ch]))
+		return layout
+
+	@classmethod
+	def compileLevels(cls, filename = None):
+		""" Parse all levels and store them in one file, so that loading a level
+		does not need to parse text """
+		layouts = {}
+		for level_nr in range(1, 36):
+			layout = cls.parseLevel(level_nr)
+			if layout is not None:
+				layouts[level_nr] = layout
+		with open(filename or cls.COMPILED_FILE, "wb") as f:
+			pickle.dump(layouts, f)
+		cls.compiled = None
+		return len(layouts)
 
 
 	def draw(self, tiles = None):
@@ -486,7 +652,7 @@ class Level():
 		if tiles == None:
 			tiles = [TILE_BRICK, TILE_STEEL, TILE_WATER, TILE_GRASS, TILE_FROZE]
 
-		for tile in self.mapr:
+		for tile in self.tiles.values():
 			if tile.type in tiles:
 				if tile.type == self.TILE_BRICK:
 					screen.blit(self.tile_brick, tile.topleft)
@@ -499,18 +665,55 @@ class Level():
 				elif tile.type == self.TILE_GRASS:
 					screen.blit(self.tile_grass, tile.topleft)
 
-	def updateObstacleRects(self):
-		""" Set self.obstacle_rects to all tiles' rects that players can destroy
-		with bullets """
+	@property
+	def obstacle_rects(self):
+		""" Castle and all tiles' rects that players can destroy with bullets """
+		return [self.world.castle.rect] + [tile for tile in self.obstacle_grid if tile is not None]
 
-		global castle
-
-		self.obstacle_rects = [castle.rect]
-		self.obstacle_rects = [castle.rect]
+	def updateObstacleRects(self):
+		""" Rebuild self.obstacle_grid from all tiles. After that addTile and removeTile
+		keep it up to date """
+
+		# tiles are aligned to the grid, so each cell holds at most one obstacle (or None)
+		self.obstacle_grid = [None] * (self.GRID_CELLS * self.GRID_CELLS)
+
+		for (x, y), tile in self.tiles.items():
+			index = self.gridIndex(x, y)
+			if index is not None and tile.type in self.OBSTACLE_TILES:
+				self.obstacle_grid[index] = tile
+
+	def collideObstacles(self, rect, first = False):
+		""" Find obstacles colliding with rect, same as rect.collidelistall(self.obstacle_rects)
+		but only the grid cells covered by rect are looked at
+		@param boolean first If True, stop at the first collision
+		@return list of colliding obstacle rects
+		"""
 
-		for tile in self.mapr:
-			if tile.type in (self.TILE_BRICK, self.TILE_STEEL, self.TILE_WATER):
-				self.obstacle_rects.append(tile)
+		collisions = []
+		castle = self.world.castle.rect
+		if rect.colliderect(castle):
+			collisions.append(castle)
+			if first:
+				return collisions
+
+		size, cells, grid = self.TILE_SIZE, self.GRID_CELLS, self.obstacle_grid
+		x1, x2 = max(rect.left // size, 0), min((rect.right - 1) // size, cells - 1)
+		y1, y2 = max(rect.top // size, 0), min((rect.bottom - 1) // size, cells - 1)
+
+		# a tile fills its whole cell, so every tile in a covered cell collides
+		for y in range(y1, y2 + 1):
+			row = y * cells
+			for x in range(x1, x2 + 1):
+				tile = grid[row + x]
+				if tile is not None:
+					collisions.append(tile)
+					if first:
+						return collisions
+		return collisions
+
+	def collidesObstacle(self, rect):
+		""" Whether rect collides with any obstacle """
+		return len(self.collideObstacles(rect, True)) > 0
 
 	def buildFortress(self, tile):
 		""" Build walls around castle made from tile """
@@ -526,18 +729,8 @@ class Level():
 			(13*self.TILE_SIZE, 23*self.TILE_SIZE)
 		]
 
-		obsolete = []
-
-		for i, rect in enumerate(self.mapr):
-			if rect.topleft in positions:
-				obsolete.append(rect)
-		for rect in obsolete:
-			self.mapr.remove(rect)
-
 		for pos in positions:
-			self.mapr.append(myRect(pos[0], pos[1], self.TILE_SIZE, self.TILE_SIZE, tile))
-
-		self.updateObstacleRects()
+			self.addTile(pos[0], pos[1], tile)
 
 
 class Tank():
@@ -551,10 +744,12 @@ class Tank():
 	# sides
 	(SIDE_PLAYER, SIDE_ENEMY) = range(2)
 
-	def __init__(self, level, side, position = None, direction = None, filename = None):
+	def __init__(self, world, level, side, position = None, direction = None, filename = None):
 
 		global sprites
 
+		self.world = world
+
 		# health. 0 health means dead
 		self.health = 100
 
@@ -595,16 +790,16 @@ class Tank():
 		self.pressed = [False] * 4
 
 		self.shield_images = [
-			sprites.subsurface(0, 48*2, 16*2, 16*2),
-			sprites.subsurface(16*2, 48*2, 16*2, 16*2)
+			getImage(world, (0, 48*2, 16*2, 16*2)),
+			getImage(world, (16*2, 48*2, 16*2, 16*2))
+		]
+		self.spawn_images = [
+			getImage(world, (32*2, 48*2, 16*2, 16*2)),
+			getImage(world, (48*2, 48*2, 16*2, 16*2))
 		]
 		self.shield_image = self.shield_images[0]
 		self.shield_index = 0
 
-		self.spawn_images = [
-			sprites.subsurface(32*2, 48*2, 16*2, 16*2),
-			sprites.subsurface(48*2, 48*2, 16*2, 16*2)
-		]
 		self.spawn_image = self.spawn_images[0]
 		self.spawn_index = 0
 
@@ -617,30 +812,30 @@ class Tank():
 
 
 		if direction == None:
-			self.direction = random.choice([self.DIR_RIGHT, self.DIR_DOWN, self.DIR_LEFT])
+			self.direction = world.random.choice([self.DIR_RIGHT, self.DIR_DOWN, self.DIR_LEFT])
 		else:
 			self.direction = direction
 
 		self.state = self.STATE_SPAWNING
 
 		# spawning animation
-		self.timer_uuid_spawn = gtimer.add(100, lambda :self.toggleSpawnImage())
+		self.timer_uuid_spawn = self.world.timer.add(100, lambda :self.toggleSpawnImage())
 
 		# duration of spawning
-		self.timer_uuid_spawn_end = gtimer.add(1000, lambda :self.endSpawning())
+		self.timer_uuid_spawn_end = self.world.timer.add(1000, lambda :self.endSpawning())
 
 	def endSpawning(self):
 		""" End spawning
 		Player becomes operational
 		"""
 		self.state = self.STATE_ALIVE
-		gtimer.destroy(self.timer_uuid_spawn_end)
+		self.world.timer.destroy(self.timer_uuid_spawn_end)
 
 
 	def toggleSpawnImage(self):
 		""" advance to the next spawn image """
 		if self.state != self.STATE_SPAWNING:
-			gtimer.destroy(self.timer_uuid_spawn)
+			self.world.timer.destroy(self.timer_uuid_spawn)
 			return
 		self.spawn_index += 1
 		if self.spawn_index >= len(self.spawn_images):
@@ -650,7 +845,7 @@ class Tank():
 	def toggleShieldImage(self):
 		""" advance to the next shield image """
 		if self.state != self.STATE_ALIVE:
-			gtimer.destroy(self.timer_uuid_shield)
+			self.world.timer.destroy(self.timer_uuid_shield)
 			return
 		if self.shielded:
 			self.shield_index += 1
@@ -675,7 +870,7 @@ class Tank():
 		""" start tanks's explosion """
 		if self.state != self.STATE_DEAD:
 			self.state = self.STATE_EXPLODING
-			self.explosion = Explosion(self.rect.topleft)
+			self.explosion = Explosion(self.world, self.rect.topleft)
 
 			# if self.bonus:
 			# 	self.spawnBonus()
@@ -686,10 +881,8 @@ class Tank():
 		@return boolean True if bullet was fired, false otherwise
 		"""
 
-		global bullets, labels
-
 		if self.state != self.STATE_ALIVE:
-			gtimer.destroy(self.timer_uuid_fire)
+			self.world.timer.destroy(self.timer_uuid_fire)
 			return False
 
 		if self.paused:
@@ -697,13 +890,13 @@ class Tank():
 
 		if not forced:
 			active_bullets = 0
-			for bullet in bullets:
+			for bullet in self.world.bullets:
 				if bullet.owner_class == self and bullet.state == bullet.STATE_ACTIVE:
 					active_bullets += 1
 			if active_bullets >= self.max_active_bullets:
 				return False
 
-		bullet = Bullet(self.level, self.rect.topleft, self.direction)
+		bullet = Bullet(self.world, self.level, self.rect.topleft, self.direction)
 
 		# if superpower level is at least 1
 		if self.superpowers > 0:
@@ -720,7 +913,7 @@ class Tank():
 			self.bullet_queued = False
 
 		bullet.owner_class = self
-		bullets.append(bullet)
+		self.world.bullets.append(bullet)
 		return True
 
 	def rotate(self, direction, fix_position = True):
@@ -788,7 +981,7 @@ class Tank():
 					if play_sounds:
 						sounds["explosion"].play()
 
-					labels.append(Label(self.rect.topleft, str(points), 500))
+					self.world.labels.append(Label(self.world, self.rect.topleft, str(points), 500))
 
 				self.explode()
 			return True
@@ -798,7 +991,7 @@ class Tank():
 		elif self.side == self.SIDE_PLAYER:
 			if not self.paralised:
 				self.setParalised(True)
-				self.timer_uuid_paralise = gtimer.add(10000, lambda :self.setParalised(False), 1)
+				self.timer_uuid_paralise = self.world.timer.add(10000, lambda :self.setParalised(False), 1)
 			return True
 
 	def setParalised(self, paralised = True):
@@ -807,7 +1000,7 @@ class Tank():
 		@return None
 		"""
 		if self.state != self.STATE_ALIVE:
-			gtimer.destroy(self.timer_uuid_paralise)
+			self.world.timer.destroy(self.timer_uuid_paralise)
 			return
 		self.paralised = paralised
 
@@ -816,11 +1009,11 @@ class Enemy(Tank):
 
 	(TYPE_BASIC, TYPE_FAST, TYPE_POWER, TYPE_ARMOR) = range(4)
 
-	def __init__(self, level, type, position = None, direction = None, filename = None):
+	def __init__(self, world, level, type, position = None, direction = None, filename = None):
 
-		Tank.__init__(self, level, type, position = None, direction = None, filename = None)
+		Tank.__init__(self, world, level, type, position = None, direction = None, filename = None)
 
-		global enemies, sprites
+		global sprites
 
 		# if true, do not fire
 		self.bullet_queued = False
@@ -842,30 +1035,17 @@ class Enemy(Tank):
 			self.health = 400
 
 		# 1 in 5 chance this will be bonus carrier, but only if no other tank is
-		if random.randint(1, 5) == 1:
+		if world.random.randint(1, 5) == 1:
 			self.bonus = True
-			for enemy in enemies:
+			for enemy in self.world.enemies:
 				if enemy.bonus:
 					self.bonus = False
 					break
 
-		images = [
-			sprites.subsurface(32*2, 0, 13*2, 15*2),
-			sprites.subsurface(48*2, 0, 13*2, 15*2),
-			sprites.subsurface(64*2, 0, 13*2, 15*2),
-			sprites.subsurface(80*2, 0, 13*2, 15*2),
-			sprites.subsurface(32*2, 16*2, 13*2, 15*2),
-			sprites.subsurface(48*2, 16*2, 13*2, 15*2),
-			sprites.subsurface(64*2, 16*2, 13*2, 15*2),
-			sprites.subsurface(80*2, 16*2, 13*2, 15*2)
-		]
-
-		self.image = images[self.type+0]
-
-		self.image_up = self.image;
-		self.image_left = pygame.transform.rotate(self.image, 90)
-		self.image_down = pygame.transform.rotate(self.image, 180)
-		self.image_right = pygame.transform.rotate(self.image, 270)
+		# sprite of each enemy type, the second row is the blinking bonus carrier
+		rect = (32*2 + 16*2*self.type, 0, 13*2, 15*2)
+		self.image_up, self.image_right, self.image_down, self.image_left = getDirectionImages(world, rect)
+		self.image = self.image_up
 
 		if self.bonus:
 			self.image1_up = self.image_up;
@@ -873,11 +1053,9 @@ class Enemy(Tank):
 			self.image1_down = self.image_down
 			self.image1_right = self.image_right
 
-			self.image2 = images[self.type+4]
-			self.image2_up = self.image2;
-			self.image2_left = pygame.transform.rotate(self.image2, 90)
-			self.image2_down = pygame.transform.rotate(self.image2, 180)
-			self.image2_right = pygame.transform.rotate(self.image2, 270)
+			rect = (32*2 + 16*2*self.type, 16*2, 13*2, 15*2)
+			self.image2_up, self.image2_right, self.image2_down, self.image2_left = getDirectionImages(world, rect)
+			self.image2 = self.image2_up
 
 		self.rotate(self.direction, False)
 
@@ -891,16 +1069,16 @@ class Enemy(Tank):
 		self.path = self.generatePath(self.direction)
 
 		# 1000 is duration between shots
-		self.timer_uuid_fire = gtimer.add(1000, lambda :self.fire())
+		self.timer_uuid_fire = self.world.timer.add(1000, lambda :self.fire())
 
 		# turn on flashing
 		if self.bonus:
-			self.timer_uuid_flash = gtimer.add(200, lambda :self.toggleFlash())
+			self.timer_uuid_flash = self.world.timer.add(200, lambda :self.toggleFlash())
 
 	def toggleFlash(self):
 		""" Toggle flash state """
 		if self.state not in (self.STATE_ALIVE, self.STATE_SPAWNING):
-			gtimer.destroy(self.timer_uuid_flash)
+			self.world.timer.destroy(self.timer_uuid_flash)
 			return
 		self.flash = not self.flash
 		if self.flash:
@@ -918,19 +1096,19 @@ class Enemy(Tank):
 	def spawnBonus(self):
 		""" Create new bonus if needed """
 
-		global bonuses
+		bonuses = self.world.bonuses
 
 		if len(bonuses) > 0:
 			return
-		bonus = Bonus(self.level)
+		bonus = Bonus(self.world, self.level)
 		bonuses.append(bonus)
-		gtimer.add(500, lambda :bonus.toggleVisibility())
-		gtimer.add(10000, lambda :bonuses.remove(bonus), 1)
+		self.world.timer.add(500, lambda :bonus.toggleVisibility())
+		self.world.timer.add(10000, lambda :bonuses.remove(bonus), 1)
 
 
 	def getFreeSpawningPosition(self):
 
-		global players, enemies
+		world = self.world
 
 		available_positions = [
 			[(self.level.TILE_SIZE * 2 - self.rect.width) / 2, (self.level.TILE_SIZE * 2 - self.rect.height) / 2],
@@ -938,7 +1116,7 @@ class Enemy(Tank):
 			[24 * self.level.TILE_SIZE + (self.level.TILE_SIZE * 2 - self.rect.width) / 2,  (self.level.TILE_SIZE * 2 - self.rect.height) / 2]
 		]
 
-		random.shuffle(available_positions)
+		world.random.shuffle(available_positions)
 
 		for pos in available_positions:
 
@@ -946,7 +1124,7 @@ class Enemy(Tank):
 
 			# collisions with other enemies
 			collision = False
-			for enemy in enemies:
+			for enemy in world.enemies:
 				if enemy_rect.colliderect(enemy.rect):
 					collision = True
 					continue
@@ -956,7 +1134,7 @@ class Enemy(Tank):
 
 			# collisions with players
 			collision = False
-			for player in players:
+			for player in world.players:
 				if enemy_rect.colliderect(player.rect):
 					collision = True
 					continue
@@ -970,7 +1148,7 @@ class Enemy(Tank):
 	def move(self):
 		""" move enemy if possible """
 
-		global players, enemies, bonuses
+		world = self.world
 
 		if self.state != self.STATE_ALIVE or self.paused or self.paralised:
 			return
@@ -1001,28 +1179,28 @@ class Enemy(Tank):
 		new_rect = pygame.Rect(new_position, [26, 26])
 
 		# collisions with tiles
-		if new_rect.collidelist(self.level.obstacle_rects) != -1:
+		if self.level.collidesObstacle(new_rect):
 			self.path = self.generatePath(self.direction, True)
 			return
 
 		# collisions with other enemies
-		for enemy in enemies:
+		for enemy in world.enemies:
 			if enemy != self and new_rect.colliderect(enemy.rect):
 				self.turnAround()
 				self.path = self.generatePath(self.direction)
 				return
 
 		# collisions with players
-		for player in players:
+		for player in world.players:
 			if new_rect.colliderect(player.rect):
 				self.turnAround()
 				self.path = self.generatePath(self.direction)
 				return
 
 		# collisions with bonuses
-		for bonus in bonuses:
+		for bonus in world.bonuses:
 			if new_rect.colliderect(bonus.rect):
-				bonuses.remove(bonus)
+				world.bonuses.remove(bonus)
 
 		# if no collision, move enemy
 		self.rect.topleft = new_rect.topleft
@@ -1045,7 +1223,7 @@ class Enemy(Tank):
 			else:
 				opposite_direction = self.direction - 2
 			directions = all_directions
-			random.shuffle(directions)
+			self.world.random.shuffle(directions)
 			directions.remove(opposite_direction)
 			directions.append(opposite_direction)
 		else:
@@ -1059,7 +1237,7 @@ class Enemy(Tank):
 			else:
 				opposite_direction = direction - 2
 			directions = all_directions
-			random.shuffle(directions)
+			self.world.random.shuffle(directions)
 			directions.remove(opposite_direction)
 			directions.remove(direction)
 			directions.insert(0, direction)
@@ -1074,22 +1252,22 @@ class Enemy(Tank):
 		for direction in directions:
 			if direction == self.DIR_UP and y > 1:
 				new_pos_rect = self.rect.move(0, -8)
-				if new_pos_rect.collidelist(self.level.obstacle_rects) == -1:
+				if not self.level.collidesObstacle(new_pos_rect):
 					new_direction = direction
 					break
 			elif direction == self.DIR_RIGHT and x < 24:
 				new_pos_rect = self.rect.move(8, 0)
-				if new_pos_rect.collidelist(self.level.obstacle_rects) == -1:
+				if not self.level.collidesObstacle(new_pos_rect):
 					new_direction = direction
 					break
 			elif direction == self.DIR_DOWN and y < 24:
 				new_pos_rect = self.rect.move(0, 8)
-				if new_pos_rect.collidelist(self.level.obstacle_rects) == -1:
+				if not self.level.collidesObstacle(new_pos_rect):
 					new_direction = direction
 					break
 			elif direction == self.DIR_LEFT and x > 1:
 				new_pos_rect = self.rect.move(-8, 0)
-				if new_pos_rect.collidelist(self.level.obstacle_rects) == -1:
+				if not self.level.collidesObstacle(new_pos_rect):
 					new_direction = direction
 					break
 
@@ -1115,7 +1293,7 @@ class Enemy(Tank):
 			axis_fix = self.nearest(x, 16) - x
 		axis_fix = 0
 
-		pixels = self.nearest(random.randint(1, 12) * 32, 32) + axis_fix + 3
+		pixels = self.nearest(self.world.random.randint(1, 12) * 32, 32) + axis_fix + 3
 
 		if new_direction == self.DIR_UP:
 			for px in range(0, pixels, self.speed):
@@ -1135,9 +1313,9 @@ class Enemy(Tank):
 
 class Player(Tank):
 
-	def __init__(self, level, type, position = None, direction = None, filename = None):
+	def __init__(self, world, level, type, position = None, direction = None, filename = None):
 
-		Tank.__init__(self, level, type, position = None, direction = None, filename = None)
+		Tank.__init__(self, world, level, type, position = None, direction = None, filename = None)
 
 		global sprites
 
@@ -1162,11 +1340,8 @@ class Player(Tank):
 			"enemy3" : 0
 		}
 
-		self.image = sprites.subsurface(filename)
-		self.image_up = self.image;
-		self.image_left = pygame.transform.rotate(self.image, 90)
-		self.image_down = pygame.transform.rotate(self.image, 180)
-		self.image_right = pygame.transform.rotate(self.image, 270)
+		self.image_up, self.image_right, self.image_down, self.image_left = getDirectionImages(world, tuple(filename))
+		self.image = self.image_up
 
 		if direction == None:
 			self.rotate(self.DIR_UP, False)
@@ -1176,7 +1351,7 @@ class Player(Tank):
 	def move(self, direction):
 		""" move player if possible """
 
-		global players, enemies, bonuses
+		world = self.world
 
 		if self.state == self.STATE_EXPLODING:
 			if not self.explosion.active:
@@ -1214,21 +1389,21 @@ class Player(Tank):
 		player_rect = pygame.Rect(new_position, [26, 26])
 
 		# collisions with tiles
-		if player_rect.collidelist(self.level.obstacle_rects) != -1:
+		if self.level.collidesObstacle(player_rect):
 			return
 
 		# collisions with other players
-		for player in players:
+		for player in world.players:
 			if player != self and player.state == player.STATE_ALIVE and player_rect.colliderect(player.rect) == True:
 				return
 
 		# collisions with enemies
-		for enemy in enemies:
+		for enemy in world.enemies:
 			if player_rect.colliderect(enemy.rect) == True:
 				return
 
 		# collisions with bonuses
-		for bonus in bonuses:
+		for bonus in world.bonuses:
 			if player_rect.colliderect(bonus.rect) == True:
 				self.bonus = bonus
 
@@ -1255,10 +1430,29 @@ class Game():
 
 	TILE_SIZE = 16
 
-	def __init__(self, show=True):
+	def __init__(self, show=True, world=None):
 
 		global screen, sprites, play_sounds, sounds
 
+		# tanks, bullets, castle etc. of this game. Without a window the game runs headless
+		self.world = World(headless = not show) if world is None else world
+
+		# if true, no new enemies will be spawn during this time
+		self.timefreeze = False
+
+		# number of players. here is defined preselected menu value
+		self.nr_of_players = 1
+
+		self.game_over_y = 416+40
+
+		del self.world.players[:]
+		self.world.clear()
+
+		if self.world.headless:
+			# pure game logic: no pygame init, display, clock, sprites, sounds or fonts
+			self.clock = None
+			return
+
 		# center window
 		os.environ['SDL_VIDEO_WINDOW_POS'] = 'center'
 
@@ -1281,8 +1475,10 @@ class Game():
 
 		# load sprites (funky version)
 		#sprites = pygame.transform.scale2x(pygame.image.load("images/sprites.gif"))
-		# load sprites (pixely version)
-		sprites = pygame.transform.scale(pygame.image.load("images/sprites.gif"), [192, 224])
+		# load sprites (pixely version), once per process, all games share the same atlas
+		if sprites is None:
+			sprites = pygame.transform.scale(pygame.image.load("images/sprites.gif"), [192, 224])
+			images.clear()
 		#screen.set_colorkey((0,138,104))
 
 		pygame.display.set_icon(sprites.subsurface(0, 0, 13*2, 13*2))
@@ -1301,15 +1497,12 @@ class Game():
 			sounds["brick"] = pygame.mixer.Sound("sounds/brick.ogg")
 			sounds["steel"] = pygame.mixer.Sound("sounds/steel.ogg")
 
-		self.enemy_life_image = sprites.subsurface(81*2, 57*2, 7*2, 7*2)
-		self.player_life_image = sprites.subsurface(89*2, 56*2, 7*2, 8*2)
-		self.flag_image = sprites.subsurface(64*2, 49*2, 16*2, 15*2)
+		self.enemy_life_image = getImage(self.world, (81*2, 57*2, 7*2, 7*2))
+		self.player_life_image = getImage(self.world, (89*2, 56*2, 7*2, 8*2))
+		self.flag_image = getImage(self.world, (64*2, 49*2, 16*2, 15*2))
 
 		# this is used in intro screen
-		self.player_image = pygame.transform.rotate(sprites.subsurface(0, 0, 13*2, 13*2), 270)
-
-		# if true, no new enemies will be spawn during this time
-		self.timefreeze = False
+		self.player_image = getImage(self.world, (0, 0, 13*2, 13*2), 270)
 
 		# load custom font
 		self.font = pygame.font.Font("fonts/prstart.ttf", 16)
@@ -1319,20 +1512,11 @@ class Game():
 		self.im_game_over.set_colorkey((0,0,0))
 		self.im_game_over.blit(self.font.render("GAME", False, (127, 64, 64)), [0, 0])
 		self.im_game_over.blit(self.font.render("OVER", False, (127, 64, 64)), [0, 20])
-		self.game_over_y = 416+40
-
-		# number of players. here is defined preselected menu value
-		self.nr_of_players = 1
-
-		del players[:]
-		del bullets[:]
-		del enemies[:]
-		del bonuses[:]
 
 	def triggerBonus(self, bonus, player):
 		""" Execute bonus powers """
 
-		global enemies, labels, play_sounds, sounds
+		global play_sounds, sounds
 
 		if play_sounds:
 			sounds["bonus"].play()
@@ -1341,13 +1525,13 @@ class Game():
 		player.score += 500
 
 		if bonus.bonus == bonus.BONUS_GRENADE:
-			for enemy in enemies:
+			for enemy in self.world.enemies:
 				enemy.explode()
 		elif bonus.bonus == bonus.BONUS_HELMET:
 			self.shieldPlayer(player, True, 10000)
 		elif bonus.bonus == bonus.BONUS_SHOVEL:
 			self.level.buildFortress(self.level.TILE_STEEL)
-			gtimer.add(10000, lambda :self.level.buildFortress(self.level.TILE_BRICK), 1)
+			self.world.timer.add(10000, lambda :self.level.buildFortress(self.level.TILE_BRICK), 1)
 		elif bonus.bonus == bonus.BONUS_STAR:
 			player.superpowers += 1
 			if player.superpowers == 2:
@@ -1356,10 +1540,10 @@ class Game():
 			player.lives += 1
 		elif bonus.bonus == bonus.BONUS_TIMER:
 			self.toggleEnemyFreeze(True)
-			gtimer.add(10000, lambda :self.toggleEnemyFreeze(False), 1)
-		bonuses.remove(bonus)
+			self.world.timer.add(10000, lambda :self.toggleEnemyFreeze(False), 1)
+		self.world.bonuses.remove(bonus)
 
-		labels.append(Label(bonus.rect.topleft, "500", 500))
+		self.world.labels.append(Label(self.world, bonus.rect.topleft, "500", 500))
 
 	def shieldPlayer(self, player, shield = True, duration = None):
 		""" Add/remove shield
@@ -1369,12 +1553,12 @@ class Game():
 		"""
 		player.shielded = shield
 		if shield:
-			player.timer_uuid_shield = gtimer.add(100, lambda :player.toggleShieldImage())
+			player.timer_uuid_shield = self.world.timer.add(100, lambda :player.toggleShieldImage())
 		else:
-			gtimer.destroy(player.timer_uuid_shield)
+			self.world.timer.destroy(player.timer_uuid_shield)
 
 		if shield and duration != None:
-			gtimer.add(duration, lambda :self.shieldPlayer(player, False), 1)
+			self.world.timer.add(duration, lambda :self.shieldPlayer(player, False), 1)
 
 	def spawnEnemy(self):
 		""" Spawn new enemy if needed
@@ -1384,13 +1568,13 @@ class Game():
 			- now isn't timefreeze
 		"""
 
-		global enemies
+		enemies = self.world.enemies
 
 		if len(enemies) >= self.level.max_active_enemies:
 			return
 		if len(self.level.enemies_left) < 1 or self.timefreeze:
 			return
-		enemy = Enemy(self.level, 1)
+		enemy = Enemy(self.world, self.level, 1)
 
 		enemies.append(enemy)
 
@@ -1419,7 +1603,7 @@ class Game():
 		self.game_over_y = 416+40
 
 		self.game_over = True
-		gtimer.add(3000, lambda :self.showScores(), 1)
+		self.world.timer.add(3000, lambda :self.showScores(), 1)
 
 	def gameOverScreen(self):
 		""" Show game over screen """
@@ -1454,13 +1638,13 @@ class Game():
 		exit from this screen and start the game with selected number of players
 		"""
 
-		global players, screen
+		global screen
 
 		# stop game main loop (if any)
 		self.running = False
 
 		# clear all timers
-		del gtimer.timers[:]
+		self.world.timer.clear()
 
 		# set current stage to 0
 		self.stage = 0
@@ -1494,7 +1678,7 @@ class Game():
 						main_loop = False
 
 		self.is_in_menu = False
-		del players[:]
+		del self.world.players[:]
 		self.nextLevel()
 
 	def reloadPlayers(self):
@@ -1502,7 +1686,7 @@ class Game():
 		If players already exist, just reset them
 		"""
 
-		global players
+		players = self.world.players
 
 		if len(players) == 0:
 			# first player
@@ -1510,7 +1694,7 @@ class Game():
 			y = 24 * self.TILE_SIZE + (self.TILE_SIZE * 2 - 26) / 2
 
 			player = Player(
-				self.level, 0, [x, y], self.DIR_UP, (0, 0, 13*2, 13*2)
+				self.world, self.level, 0, [x, y], self.DIR_UP, (0, 0, 13*2, 13*2)
 			)
 			players.append(player)
 
@@ -1519,7 +1703,7 @@ class Game():
 				x = 16 * self.TILE_SIZE + (self.TILE_SIZE * 2 - 26) / 2
 				y = 24 * self.TILE_SIZE + (self.TILE_SIZE * 2 - 26) / 2
 				player = Player(
-					self.level, 0, [x, y], self.DIR_UP, (16*2, 0, 13*2, 13*2)
+					self.world, self.level, 0, [x, y], self.DIR_UP, (16*2, 0, 13*2, 13*2)
 				)
 				player.controls = [102, 119, 100, 115, 97]
 				players.append(player)
@@ -1531,13 +1715,15 @@ class Game():
 	def showScores(self):
 		""" Show level scores """
 
-		global screen, sprites, players, play_sounds, sounds
+		global screen, sprites, play_sounds, sounds
+
+		players = self.world.players
 
 		# stop game main loop (if any)
 		self.running = False
 
 		# clear all timers
-		del gtimer.timers[:]
+		self.world.timer.clear()
 
 		if play_sounds:
 			for sound in sounds:
@@ -1666,27 +1852,29 @@ class Game():
 			self.nextLevel()
 
 	def draw(self):
-		global screen, castle, players, enemies, bullets, bonuses
+		global screen
+
+		world = self.world
 
 		screen.fill([0, 0, 0])
 
 		self.level.draw([self.level.TILE_EMPTY, self.level.TILE_BRICK, self.level.TILE_STEEL, self.level.TILE_FROZE, self.level.TILE_WATER])
 
-		castle.draw()
+		world.castle.draw()
 
-		for enemy in enemies:
+		for enemy in world.enemies:
 			enemy.draw()
 
-		for label in labels:
+		for label in world.labels:
 			label.draw()
 
-		for player in players:
+		for player in world.players:
 			player.draw()
 
-		for bullet in bullets:
+		for bullet in world.bullets:
 			bullet.draw()
 
-		for bonus in bonuses:
+		for bonus in world.bonuses:
 			bonus.draw()
 
 		self.level.draw([self.level.TILE_GRASS])
@@ -1702,7 +1890,9 @@ class Game():
 
 	def drawSidebar(self):
 
-		global screen, players, enemies
+		global screen
+
+		players = self.world.players
 
 		x = 416
 		y = 0
@@ -1712,7 +1902,7 @@ class Game():
 		ypos = y + 16
 
 		# draw enemy lives
-		for n in range(len(self.level.enemies_left) + len(enemies)):
+		for n in range(len(self.level.enemies_left) + len(self.world.enemies)):
 			screen.blit(self.enemy_life_image, [xpos, ypos])
 			if n % 2 == 1:
 				xpos = x + 16
@@ -1874,9 +2064,7 @@ class Game():
 	def toggleEnemyFreeze(self, freeze = True):
 		""" Freeze/defreeze all enemies """
 
-		global enemies
-
-		for enemy in enemies:
+		for enemy in self.world.enemies:
 			enemy.paused = freeze
 		self.timefreeze = freeze
 
@@ -1922,25 +2110,25 @@ class Game():
 			sounds["bg"].stop()
 
 		self.active = False
-		gtimer.add(3000, lambda :self.showScores(), 1)
+		self.world.timer.add(3000, lambda :self.showScores(), 1)
 
 		print( "Stage "+str(self.stage)+" completed")
 
 	def nextLevel(self):
 		""" Start next level """
 
-		global castle, players, bullets, bonuses, play_sounds, sounds
+		global play_sounds, sounds
+
+		world = self.world
+		players, enemies, bullets, bonuses, labels = world.players, world.enemies, world.bullets, world.bonuses, world.labels
 
-		del bullets[:]
-		del enemies[:]
-		del bonuses[:]
-		castle.rebuild()
-		del gtimer.timers[:]
+		world.clear()
+		world.castle.rebuild()
 
 		# load level
 		self.stage += 1
 		self.stage += 1
-		self.level = Level(self.stage)
+		self.level = Level(world, self.stage)
 		self.timefreeze = False
 
 		# set number of enemies by types (basic, fast, power, armor) according to level
@@ -1960,15 +2148,15 @@ class Game():
 			enemies_l = levels_enemies[34]
 
 		self.level.enemies_left = [0]*enemies_l[0] + [1]*enemies_l[1] + [2]*enemies_l[2] + [3]*enemies_l[3]
-		random.shuffle(self.level.enemies_left)
+		world.random.shuffle(self.level.enemies_left)
 
 		if play_sounds:
 			sounds["start"].play()
-			gtimer.add(4330, lambda :sounds["bg"].play(-1), 1)
+			self.world.timer.add(4330, lambda :sounds["bg"].play(-1), 1)
 
 		self.reloadPlayers()
 
-		gtimer.add(500, lambda :self.spawnEnemy())
+		self.world.timer.add(500, lambda :self.spawnEnemy())
 
 		# if True, start "game over" animation
 		self.game_over = False
@@ -2087,31 +2275,28 @@ class Game():
 					labels.remove(label)
 
 			if not self.game_over:
-				if not castle.active:
+				if not world.castle.active:
 					self.gameOver()
 
-			gtimer.update(time_passed)
+			world.timer.update(time_passed)
 			self.draw()
 
 
-gtimer = Timer()
-
 sprites = None
+# images cut from sprites, see getImage
+images = {}
 screen = None
-players = []
-enemies = []
-bullets = []
-bonuses = []
-labels = []
 
 play_sounds = False
 sounds = {}
 
 game = None
-castle = None
 quick = 1
 
 if __name__ == "__main__":
+	if "--compile-levels" in sys.argv[1:]:
+		print(str(Level.compileLevels())+" levels compiled to "+Level.COMPILED_FILE)
+		sys.exit()
 	game = Game()
-	castle = Castle()
+	game.world.castle = Castle(game.world)
 	game.showMenu()
\ No newline at end of file
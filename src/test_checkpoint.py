@@ -0,0 +1,53 @@
+import json
+import os
+
+import torch
+
+from checkpoint import CheckpointManager
+
+
+def write_old_run(directory, steps=(995, 1000, 1005)):
+    for step in steps:
+        torch.save({'episode': step}, os.path.join(directory, f'ckpt_{step}.pt'))
+    with open(os.path.join(directory, CheckpointManager.INDEX_FILE), 'w') as f:
+        json.dump({str(step): 1e9 for step in steps}, f)
+
+
+def saved_steps(directory):
+    return sorted(int(name[5:-3]) for name in os.listdir(directory) if name.startswith('ckpt_'))
+
+
+def test_new_run_moves_old_checkpoints_away(tmp_path):
+    write_old_run(tmp_path)
+    checkpoints = CheckpointManager(str(tmp_path), keep_last=3, keep_best=3, every_steps=5, resume=False)
+    for step in range(1, 11):
+        checkpoints.maybe_save(step, float(step), lambda: {'episode': step})
+    checkpoints.close()
+
+    # 新一次训练的检查点不会因为上一次训练的得分更高、轮数更大而被删除
+    assert saved_steps(tmp_path) == [5, 10]
+    assert checkpoints.latest() == os.path.join(str(tmp_path), 'ckpt_10.pt')
+    with open(tmp_path / CheckpointManager.INDEX_FILE) as f:
+        assert json.load(f) == {'5': 5.0, '10': 10.0}
+
+    old_run = tmp_path / CheckpointManager.OLD_RUNS_DIR / 'run_1'
+    assert saved_steps(old_run) == [995, 1000, 1005]
+    assert torch.load(old_run / 'ckpt_1000.pt') == {'episode': 1000}
+    assert os.path.isfile(old_run / CheckpointManager.INDEX_FILE)
+
+    # 再开始一次新的训练，上一次的检查点移到下一个子目录
+    CheckpointManager(str(tmp_path), resume=False).close()
+    assert saved_steps(tmp_path / CheckpointManager.OLD_RUNS_DIR / 'run_2') == [5, 10]
+    assert saved_steps(tmp_path) == []
+
+
+def test_resumed_run_keeps_old_checkpoints(tmp_path):
+    write_old_run(tmp_path)
+    checkpoints = CheckpointManager(str(tmp_path), keep_last=2, keep_best=1, every_steps=5, resume=True)
+    assert checkpoints.latest() == os.path.join(str(tmp_path), 'ckpt_1005.pt')
+    for step in (1010, 1015):
+        checkpoints.maybe_save(step, 0.0, lambda: {'episode': step})
+    checkpoints.close()
+    # 最近 2 个加上得分最高的 1 个（已有检查点得分相同时取轮数最大的）
+    assert saved_steps(tmp_path) == [1005, 1010, 1015]
+    assert not os.path.exists(tmp_path / CheckpointManager.OLD_RUNS_DIR)
@@ -0,0 +1,57 @@
+import numpy as np
+import torch
+
+from returns import discounted_returns
+
+
+def old_reward_to_go(rews, gamma=0.9):
+    # train.reward_to_go 改写前的实现，逐个元素计算
+    n = len(rews)
+    rtgs = torch.zeros_like(torch.tensor(rews))
+    for i in reversed(range(n)):
+        rtgs[i] = rews[i] + (rtgs[i+1] * gamma if i+1 < n else 0)
+    return rtgs
+
+
+def random_episodes(rng, num_episodes=50):
+    episodes = []
+    for _ in range(num_episodes):
+        n = int(rng.integers(1, 300))
+        # 与环境给出的奖励相近：数值跨度大，且是按帧平均后的浮点数
+        rews = (rng.normal(size=n) * 10 ** rng.uniform(0, 7, size=n)).round() / 8
+        episodes.append([float(r) for r in rews])
+    return episodes
+
+
+def test_matches_old_reward_to_go():
+    rng = np.random.default_rng(0)
+    for rews in random_episodes(rng, 200):
+        for gamma in (0.9, 0.99, 1.0):
+            assert torch.equal(discounted_returns(rews, gamma=gamma), old_reward_to_go(rews, gamma=gamma))
+
+
+def test_dones_split_concatenated_episodes():
+    rng = np.random.default_rng(1)
+    episodes = random_episodes(rng)
+    rews = [r for ep in episodes for r in ep]
+    dones = [float(i == len(ep) - 1) for ep in episodes for i in range(len(ep))]
+    expected = torch.cat([old_reward_to_go(ep) for ep in episodes])
+    assert torch.equal(discounted_returns(rews, dones), expected)
+
+
+def test_columns_are_independent_trajectories():
+    rng = np.random.default_rng(2)
+    n, num_envs = 120, 4
+    rews = np.float32(rng.normal(size=(n, num_envs)) * 1000)
+    dones = np.zeros((n, num_envs), dtype=np.float32)
+    dones[rng.integers(0, n, size=10), rng.integers(0, num_envs, size=10)] = 1
+    dones[-1] = 1
+    rets = discounted_returns(rews, dones)
+    assert rets.shape == (n, num_envs)
+    for j in range(num_envs):
+        assert torch.equal(rets[:, j], discounted_returns(rews[:, j], dones[:, j]))
+        # 每一段都与改写前的实现相同
+        ends = np.flatnonzero(dones[:, j]) + 1
+        starts = np.concatenate([[0], ends[:-1]])
+        for start, end in zip(starts, ends):
+            assert torch.equal(rets[start:end, j], old_reward_to_go([float(r) for r in rews[start:end, j]]))
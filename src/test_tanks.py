@@ -0,0 +1,86 @@
+import os
+import pickle
+
+import pytest
+
+import tanks
+
+
+@pytest.fixture(autouse=True)
+def in_src_dir(monkeypatch):
+    # 地图文件按相对路径 levels/ 读取
+    monkeypatch.chdir(os.path.dirname(os.path.abspath(__file__)))
+    # 每个测试重新读取地图，不使用其他测试留下的缓存
+    monkeypatch.setattr(tanks.Level, 'cache', {})
+    monkeypatch.setattr(tanks.Level, 'compiled', None)
+
+
+def build_levels():
+    world = tanks.World(headless=True)
+    world.castle = tanks.Castle(world)
+    levels = {}
+    for level_nr in range(1, 36):
+        level = tanks.Level(world, level_nr)
+        # 障碍物网格与地图中的障碍物一致，地图之外多出的格子不在网格中
+        expected = [tile for (x, y), tile in level.tiles.items()
+                    if tile.type in level.OBSTACLE_TILES and x < level.GRID_CELLS and y < level.GRID_CELLS]
+        assert sorted(map(tuple, level.obstacle_rects[1:])) == sorted(map(tuple, expected))
+        levels[level_nr] = sorted((key, tile.type) for key, tile in level.tiles.items())
+    return levels
+
+
+def test_all_levels_load_from_text_files(monkeypatch):
+    monkeypatch.setattr(tanks.Level, 'compiled', {})
+    build_levels()
+
+
+def test_all_levels_load_from_compiled_file(monkeypatch):
+    with open(tanks.Level.COMPILED_FILE, 'rb') as f:
+        compiled = pickle.load(f)
+    assert sorted(compiled) == list(range(1, 36))
+    monkeypatch.setattr(tanks.Level, 'compiled', compiled)
+    from_compiled = build_levels()
+
+    monkeypatch.setattr(tanks.Level, 'compiled', {})
+    monkeypatch.setattr(tanks.Level, 'cache', {})
+    assert build_levels() == from_compiled
+
+
+def test_tiles_outside_the_grid_can_be_removed():
+    world = tanks.World(headless=True)
+    world.castle = tanks.Castle(world)
+    level = tanks.Level(world, 31)
+    outside = [tile for (x, y), tile in level.tiles.items() if y >= level.GRID_CELLS]
+    assert outside
+    for tile in outside:
+        level.removeTile(tile)
+    level.addTile(0, level.GRID_CELLS * level.TILE_SIZE, level.TILE_BRICK)
+    assert len(level.obstacle_grid) == level.GRID_CELLS * level.GRID_CELLS
+
+
+def test_timer_added_by_callback_counts_from_start_of_frame():
+    timer = tanks.Timer()
+    calls = []
+
+    def spawn():
+        calls.append(('spawn', timer.time))
+        timer.add(30, lambda: calls.append(('child', timer.time)), 1)
+
+    timer.add(50, spawn, 1)
+    for _ in range(5):
+        timer.update(20)
+    # spawn 在第 60 毫秒（第 3 帧）触发；子计时器从这一帧开始时的 40 毫秒算起，在第 80 毫秒而不是第 100 毫秒触发
+    assert calls == [('spawn', 60), ('child', 80)]
+
+
+def test_timer_catches_up_and_fires_in_order_added():
+    timer = tanks.Timer()
+    calls = []
+    timer.add(10, lambda: calls.append('a'), 3)
+    handle = timer.add(10, lambda: calls.append('b'))
+    timer.add(10, lambda: calls.append('c'), 2)
+    timer.update(35)
+    assert calls == ['a', 'b', 'c'] * 2 + ['a', 'b']
+    timer.destroy(handle)
+    timer.update(100)
+    assert calls == ['a', 'b', 'c'] * 2 + ['a', 'b']
@@ -0,0 +1,55 @@
+import os
+from collections import defaultdict
+
+import pytest
+
+from agent import AgentVPG
+from buffer import RolloutBuffer
+from train import run_vec_episodes, vec_rollout_capacity
+from vec_env import VecEnvironment
+
+
+@pytest.fixture(autouse=True)
+def in_src_dir(monkeypatch):
+    # 环境按相对路径读取 levels/ 和 images/
+    monkeypatch.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+
+def end_episode_at(env, calls):
+    """
+    让 env 在第 calls 次 step 时提前结束一局游戏，模拟 play 任务中的提前结束
+    """
+    step = env.step
+    count = [0]
+
+    def wrapped(action, repeat=1, out=None):
+        state, reward, done = step(action, repeat=repeat, out=out)
+        count[0] += 1
+        return state, reward, done or count[0] in calls
+
+    env.step = wrapped
+    # _reset 恢复快照时会清掉实例属性，重新记录快照以保留替换后的 step
+    env.resnapshot()
+
+
+def test_several_envs_finish_on_the_same_step():
+    num_envs, max_step = 2, 10
+    venv = VecEnvironment(num_envs, enemy_num=0, max_step=max_step, seed=0)
+    # 第二个环境在第 7 步提前结束，第二轮开始时两个环境错开；第 20 步时两个环境同时结束
+    end_episode_at(venv.envs[1], {7, 20})
+    agent = AgentVPG(range(6), venv.obs.shape[1])
+    rollouts = RolloutBuffer(vec_rollout_capacity(num_envs, num_envs, max_step), venv.obs.shape[1])
+
+    lens = []
+    for _ in range(2):
+        batch = defaultdict(list)
+        results = run_vec_episodes(venv, agent, batch, num_envs)
+        lens.append([ep_len for _, ep_len, _, _ in results])
+        for ep_obs, ep_acts, ep_weights, ep_rews in zip(batch['obs'], batch['acts'], batch['weights'], batch['rews']):
+            assert len(ep_obs) == len(ep_acts) == len(ep_weights) == len(ep_rews)
+            rollouts.add(ep_obs, ep_acts, ep_weights, ep_rews)
+        assert rollouts.size == sum(lens[-1])
+        rollouts.clear()
+
+    assert lens == [[7, 10], [10, 10, 3]]
+    assert sum(lens[1]) > num_envs * max_step
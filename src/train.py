@@ -1,24 +1,31 @@
 import time
+import numpy as np
 import torch
 import pickle
 import os
+import threading
 from collections import defaultdict
 
 import tanks
-from agent import AgentVPG
+from agent import AGENTS
 import environment as Env
+from actors import ActorPool
+from buffer import RolloutBuffer
+from checkpoint import CheckpointManager, build_agent, load_agent, load_checkpoint, make_checkpoint
+from evaluate import EvalWorker
+from inference import InferenceServer
+from returns import discounted_returns
+from vec_env import VecEnvironment
+from workers import RolloutWorkerPool
 
 
 def reward_to_go(rews, gamma=0.9):
     """
     计算神经网络更新时需要的一些参数
     不要修改这个函数
+    计算过程见 returns.discounted_returns，结果总是 float32
     """
-    n = len(rews)
-    rtgs = torch.zeros_like(torch.tensor(rews))
-    for i in reversed(range(n)):
-        rtgs[i] = rews[i] + (rtgs[i+1] * gamma if i+1 < n else 0)
-    return rtgs
+    return discounted_returns(rews, gamma=gamma)
 
 
 def run_one_episode(env, agent, batch, max_step=200):
@@ -28,7 +35,7 @@ def run_one_episode(env, agent, batch, max_step=200):
 
     :param env: 虚拟环境
     :param agent: 强化学习智能体
-    :param batch: 用于收集数据的字典
+    :param batch: 用于收集数据的字典，obs/acts/weights 中每局游戏追加一个连续数组
     :param max_step: 与环境交互的最大次数
     :return:
     ep_ret: float， 本局游戏的总奖励数
@@ -36,42 +43,106 @@ def run_one_episode(env, agent, batch, max_step=200):
     killed_enemy: int， 本局游戏中被击杀的敌人数量
     done: bool， 本局游戏是否结束（敌人是否被全部击杀）
     """
-    obs, _, _ = env._reset()  # first obs comes from starting distribution
+    # 环境直接把状态写进 obs 的下一行，多出的一行存放最后一步之后的状态
+    spec = env.get_observation_spec()
+    obs = np.empty((max_step + 1,) + spec['shape'], dtype=spec['dtype'])
+    acts = np.empty(max_step, dtype=np.int64)
+    env._reset(out=obs[0])  # first obs comes from starting distribution
     ep_rews = []  # list for rewards accrued throughout ep
 
     while True:
-        # save obs
-        batch['obs'].append(obs.copy())
+        step = len(ep_rews)
 
         # act in the environment
-        act = agent.choose_action(torch.as_tensor(obs, dtype=torch.float32))
-        rew = 0
-        for _ in range(8):
-            obs, rew1, done = env._step(act)
-            rew = rew + rew1
-            if done:
-                break
-        
-        rew = rew / 8
-        
-        env.action_logs.pop(0)
-        env.action_logs.append(act)
-
+        act = agent.choose_action(torch.from_numpy(obs[step]))
+        _, rew, done = env.step(act, repeat=8, out=obs[step + 1])
 
-        batch['acts'].append(act)
+        acts[step] = act
         ep_rews.append(rew)
 
         # 当game over或者交互次数超出上限时
         if done or len(ep_rews) >= max_step:
             # if episode is over, record info about episode
             ep_ret, ep_len = sum(ep_rews), len(ep_rews)
+            batch['obs'].append(obs[:ep_len])
+            batch['acts'].append(acts[:ep_len])
+            batch['weights'].append(reward_to_go(ep_rews).numpy())
+            batch['rews'].append(np.asarray(ep_rews, dtype=np.float32))
             batch['rets'].append(ep_ret)
             batch['lens'].append(ep_len)
-            batch['weights'] = list(reward_to_go(ep_rews))
-            killed_enemy = env.enemy_num - len(env.level.enemies_left) - len(tanks.enemies)
+            killed_enemy = env.get_killed_nums()[1]
             return ep_ret, ep_len, killed_enemy, done
 
 
+def run_vec_episodes(venv, agent, batch, num_episodes):
+    """
+    在多个环境中同时模拟游戏，直到有 num_episodes 局游戏结束，收集数据
+    每一步把所有环境的状态堆叠起来，只调用一次 agent._get_policy
+    未结束的游戏会保留在 venv 中，下次调用时继续
+    最后一步可能同时结束多个环境，因此得到的局数可能多于 num_episodes，最多见 vec_rollout_capacity
+
+    :param venv: VecEnvironment, 多个虚拟环境
+    :param agent: 强化学习智能体
+    :param batch: 用于收集数据的字典
+    :param num_episodes: int, 需要收集的完整游戏局数
+    :return: list of (ep_ret, ep_len, killed_enemy, done)，每局游戏一个
+    """
+    if venv.trajs is None:
+        venv.reset()
+
+    results = []
+    while len(results) < num_episodes:
+        acts = agent.choose_actions(torch.from_numpy(venv.obs))
+        _, _, dones, infos = venv.step(acts)
+        for done, info in zip(dones, infos):
+            if done:
+                batch['obs'].append(info['obs'])
+                batch['acts'].append(info['acts'])
+                batch['weights'].append(reward_to_go(info['rews']).numpy())
+                batch['rews'].append(info['rews'])
+                batch['rets'].append(info['ep_ret'])
+                batch['lens'].append(info['ep_len'])
+                results.append((info['ep_ret'], info['ep_len'], info['killed_enemy'], info['done']))
+    return results
+
+
+def vec_rollout_capacity(num_envs, num_episodes, max_step):
+    """
+    run_vec_episodes 一次最多收集的步数，用于确定 RolloutBuffer 的容量
+    此前的步骤最多结束 num_episodes - 1 局，最后一步最多再结束 num_envs 局，每局最多 max_step 步
+    """
+    return (num_episodes + num_envs - 1) * max_step
+
+
+def run_threaded_episodes(envs, server, batch, max_step=200):
+    """
+    每个环境在各自的线程中用 run_one_episode 玩一局游戏，收集数据
+    所有线程通过同一个 InferenceServer 选择动作，同时等待的状态被合成一批做前向计算
+
+    :param envs: list of Environment, 每个线程一个
+    :param server: InferenceServer, 代替智能体选择动作
+    :param batch: 用于收集数据的字典
+    :param max_step: 与环境交互的最大次数
+    :return: list of (ep_ret, ep_len, killed_enemy, done)，每局游戏一个
+    """
+    batches = [defaultdict(list) for _ in envs]
+    results = [None] * len(envs)
+
+    def play(i):
+        results[i] = run_one_episode(envs[i], server, batches[i], max_step)
+
+    # 守护线程：训练被中断、server 关闭后，仍在等待动作的线程不会阻止进程退出
+    threads = [threading.Thread(target=play, args=(i,), daemon=True) for i in range(len(envs))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for ep_batch in batches:
+        for key in ep_batch:
+            batch[key].extend(ep_batch[key])
+    return results
+
+
 def train(task='explore', test=False, save=10, show=10, **kwargs):
     """
     主程序
@@ -87,7 +158,29 @@ def train(task='explore', test=False, save=10, show=10, **kwargs):
     :param test: False/str，
         False表示此时为训练智能体，非False时为训练好的智能体所在的路径
     :param save: save agent every 'save' episodes
-    :param show: show agent behavior every 'show' episodes
+        检查点在后台线程中写入 logs/{task}/ckpt_{轮数}.pt，continue_last_train 时从最新的检查点继续
+    :param show: evaluate agent every 'show' episodes
+        评估在单独的进程中进行（见 evaluate.EvalWorker），训练不会等待评估，0 表示不评估
+    :param num_envs: int, 同时用于收集数据的环境数量（kwargs），大于1时每轮收集 num_envs 局游戏
+    :param num_workers: int, 用于收集数据的子进程数量（kwargs），大于0时每轮由子进程收集 num_workers 局游戏
+    :param num_threads: int, 共用一个批量推理服务的线程数量（kwargs），大于0时每轮由这些线程收集 num_threads 局游戏
+    :param num_actors: int, 异步收集数据的 actor 进程数量（kwargs），大于0时学习者更新参数的同时 actor 继续玩游戏，
+        每轮从队列中取 num_actors 局游戏
+    :param max_staleness: None/int, 使用 actor 时可接受的轨迹最大滞后版本数（kwargs），None 表示不限制
+    :param off_policy_correction: bool, 使用 actor 时是否按当前策略与行为策略的概率比修正权重（kwargs）
+    :param seed: None/int, 随机数种子（kwargs），同时用于训练环境、智能体的初始参数和动作采样，
+        单进程或 num_envs 收集数据时可以复现整个训练过程；num_workers 时每个子进程玩的游戏可以复现，
+        但多个子进程的数据按完成的先后放入一轮数据中；num_threads 和 num_actors 的结果还取决于线程和进程的调度
+    :param epochs: int, 每轮收集的数据用于更新几遍（kwargs），默认由智能体决定
+    :param shuffle: bool, 每遍更新前是否打乱数据的顺序（kwargs），默认由智能体决定
+    :param agent: 'vpg'/'ppo', 新建的智能体使用的算法（kwargs）
+    :param save_seconds: None/float, 除每 save 轮外，距上次保存超过这么多秒时也保存检查点（kwargs）
+    :param keep_last: int, 保留最近的几个检查点（kwargs）
+    :param keep_best: int, 另外保留本轮平均回报最高的几个检查点（kwargs）
+    :param eval_episodes: int, 每次评估用固定种子玩几局游戏（kwargs）
+    :param record: bool, 是否保存评估的录像，用 python evaluate.py replay 录像文件 回放（kwargs）
+    :param gae_lambda: None/float, 给定时智能体带有价值网络，用 GAE 优势代替 reward_to_go 作为权重；
+        为 None 时 vpg 不使用价值网络，ppo 使用默认的 lambda（kwargs）
     :return: None
     """
     if task not in ['explore', 'play']:
@@ -110,15 +203,14 @@ def train(task='explore', test=False, save=10, show=10, **kwargs):
         max_step = 1024 * 2
         enemy_num = 5
 
-    batch = {'obs': [], 'acts': [], 'weights': [], 'rets': [], 'lens': []}
+    batch = {'obs': [], 'acts': [], 'weights': [], 'rews': [], 'logp': [], 'rets': [], 'lens': []}
 
     if test:
         tanks.quick = 5
         env = Env.Environment(show=1, debug=0, enemy_num=enemy_num)
         obs, _, _ = env._reset()
-        with open(f'logs/{task}/{test}', 'rb') as f:
-            agent = torch.load(f)
-            # agent, start_epi = pickle.load(f)
+        # 检查点只载入策略网络，旧版本保存的 log_*.pkl 也可以直接读取
+        agent = load_agent(f'logs/{task}/{test}')
         env.show = 1
         tanks.quick = 5
         run_one_episode(env, agent, defaultdict(list), max_step)
@@ -126,59 +218,143 @@ def train(task='explore', test=False, save=10, show=10, **kwargs):
         env.show = 0
     else:
         last_train_path = f'logs/{task}/last_train.pkl'
-        env = Env.Environment(show=0, debug=0, enemy_num=enemy_num)
+        seed = kwargs.get('seed', None)
+        if seed is not None:
+            # 智能体的初始参数和学习者进程中的动作采样
+            torch.manual_seed(seed)
+        env = Env.Environment(show=0, debug=0, enemy_num=enemy_num, seed=seed)
         obs, _, _ = env._reset()
         obs_dim = len(obs)
-        if kwargs.get('continue_last_train', False) and os.path.isfile(last_train_path):
+        num_envs = kwargs.get('num_envs', 1)
+        num_workers = kwargs.get('num_workers', 0)
+        num_threads = kwargs.get('num_threads', 0)
+        num_actors = kwargs.get('num_actors', 0)
+        off_policy = num_actors > 0 and kwargs.get('off_policy_correction', False)
+        if num_actors > 0:
+            actors = ActorPool(num_actors, obs_dim, len(action_space), enemy_num=enemy_num,
+                               max_step=max_step, seed=seed)
+            episodes_per_round = num_actors
+        elif num_workers > 0:
+            pool = RolloutWorkerPool(num_workers, obs_dim, len(action_space), enemy_num=enemy_num,
+                                     max_step=max_step, seed=seed)
+            episodes_per_round = num_workers
+        elif num_threads > 0:
+            thread_envs = [
+                Env.Environment(show=0, debug=0, enemy_num=enemy_num, seed=None if seed is None else seed + i)
+                for i in range(num_threads)
+            ]
+            episodes_per_round = num_threads
+        else:
+            if num_envs > 1:
+                venv = VecEnvironment(num_envs, show=0, debug=0, enemy_num=enemy_num, max_step=max_step, seed=seed)
+            episodes_per_round = max(num_envs, 1)
+        # 每轮最多收集的步数，多个环境同时收集时最后一步可能多结束几局
+        if num_actors == num_workers == num_threads == 0:
+            capacity = vec_rollout_capacity(max(num_envs, 1), episodes_per_round, max_step)
+        else:
+            capacity = episodes_per_round * max_step
+        rollouts = RolloutBuffer(capacity, obs_dim)
+        checkpoints = CheckpointManager(f'logs/{task}', keep_last=kwargs.get('keep_last', 3),
+                                        keep_best=kwargs.get('keep_best', 3), every_steps=save,
+                                        every_seconds=kwargs.get('save_seconds', None),
+                                        resume=kwargs.get('continue_last_train', False))
+        latest = checkpoints.latest()
+        if kwargs.get('continue_last_train', False) and latest is None and os.path.isfile(last_train_path):
+            # 旧版本每轮把整个智能体 pickle 到 last_train.pkl
             with open(last_train_path, 'rb') as f:
                 agent, start_epi = pickle.load(f)
             print(f'接着上次的训练结果继续训练，之前已训轮数：{start_epi}')
         else:
-            if kwargs.get('continue_last_train', False):
-                print('找不到上次训练后存储的记录，现在将重新开始训练...')
+            agent_class = AGENTS[kwargs.get('agent', 'vpg')]
+            agent_kwargs = {} if kwargs.get('gae_lambda', None) is None else {'lam': kwargs['gae_lambda']}
+            agent = agent_class(action_space=action_space, obs_dim=obs_dim, gamma=0.9, **agent_kwargs)
             start_epi = 0
-            agent = AgentVPG(action_space=action_space, obs_dim=obs_dim)
-
-        t = time.time()
-        loss = []
-        kill_log = []
-        time_cost_log = []
-        for epi in range(start_epi + 1, max_episode):
-
-            mean_rewards = []
-            ep_ret, ep_len, killed_enemy, done = run_one_episode(env, agent, batch, max_step)
-
-            for i in range(len(batch['obs'])//batch_size):
-                tmp = {}
-                for key in batch:
-                    tmp[key] = batch[key][i*batch_size:i*batch_size+batch_size]
-                loss.append(agent.update(tmp))
-
-            batch = {'obs': [], 'acts': [], 'weights': [], 'rets': [], 'lens': []}
-            mean_rewards.append(ep_ret)
-            kill_log.append(killed_enemy)
-            time_cost_log.append(ep_len)
-            if epi % 1 == 0 and not test:
-                print(f'Episode {epi}:\ntime: {time.time() - t}\t'
-                      f'current reward: {sum(mean_rewards)/len(mean_rewards)}')
-                loss = []
-                if not flag:
-                    print(f'kill log :{kill_log}')
-                    print(f'time cost log ： {time_cost_log}')
-                kill_log = []
-                time_cost_log = []
-                with open(f'logs/{task}/last_train.pkl', 'wb') as f:
-                    pickle.dump([agent, epi], f)
-
-            if epi % save == 0 and not test:
-                with open(f'logs/{task}/log_{epi}.pkl', 'wb') as f:
-                    torch.save(agent, f)
-            if epi % show == 0 and not test:
-                env.show = 1
-                tanks.quick = 5#5
-                run_one_episode(env, agent, defaultdict(list), max_step)
-                tanks.quick = 0
-                env.show = 0
+            if kwargs.get('continue_last_train', False) and latest is not None:
+                # 算法和超参数以检查点中记录的为准
+                ckpt = load_checkpoint(latest)
+                agent = build_agent(ckpt, training=True)
+                start_epi = ckpt['episode']
+                print(f'接着上次的训练结果继续训练，之前已训轮数：{start_epi}')
+            elif kwargs.get('continue_last_train', False):
+                print('找不到上次训练后存储的记录，现在将重新开始训练...')
+        # 没有指定时使用智能体自己的默认值：vpg 每轮数据按顺序用一遍，ppo 打乱顺序用多遍
+        epochs = kwargs.get('epochs', agent.epochs)
+        shuffle = kwargs.get('shuffle', agent.shuffle)
+        if num_threads > 0:
+            server = InferenceServer(agent.logits_net, obs_dim, max_batch=num_threads)
+        if num_actors > 0:
+            actors.set_weights(agent.logits_net.state_dict())
+        if show:
+            evaluator = EvalWorker(f'logs/{task}', num_episodes=kwargs.get('eval_episodes', 3), enemy_num=enemy_num,
+                                   max_step=max_step, every=show, record=kwargs.get('record', False))
+
+        try:
+            t = time.time()
+            loss = []
+            kill_log = []
+            time_cost_log = []
+            for epi in range(start_epi + 1, max_episode):
+
+                mean_rewards = []
+                if num_actors > 0:
+                    results, staleness = actors.get(batch, num_actors, kwargs.get('max_staleness', None))
+                elif num_workers > 0:
+                    pool.set_weights(agent.logits_net.state_dict())
+                    results = pool.run(batch, num_workers)
+                elif num_threads > 0:
+                    results = run_threaded_episodes(thread_envs, server, batch, max_step)
+                elif num_envs > 1:
+                    results = run_vec_episodes(venv, agent, batch, num_envs)
+                else:
+                    results = [run_one_episode(env, agent, batch, max_step)]
+
+                logps = batch['logp'] if batch['logp'] else [None] * len(batch['obs'])
+                for ep_obs, ep_acts, ep_weights, ep_rews, ep_logp in zip(batch['obs'], batch['acts'], batch['weights'],
+                                                                         batch['rews'], logps):
+                    rollouts.add(ep_obs, ep_acts, ep_weights, ep_rews, ep_logp)
+                agent.prepare(rollouts, off_policy=off_policy)
+                for minibatch in rollouts.minibatches(batch_size, epochs=epochs, shuffle=shuffle):
+                    loss.append(agent.update(minibatch))
+                rollouts.clear()
+                if num_actors > 0:
+                    actors.set_weights(agent.logits_net.state_dict())
+
+                batch = {'obs': [], 'acts': [], 'weights': [], 'rews': [], 'logp': [], 'rets': [], 'lens': []}
+                for ep_ret, ep_len, killed_enemy, done in results:
+                    mean_rewards.append(ep_ret)
+                    kill_log.append(killed_enemy)
+                    time_cost_log.append(ep_len)
+                if epi % 1 == 0 and not test:
+                    print(f'Episode {epi}:\ntime: {time.time() - t}\t'
+                          f'current reward: {sum(mean_rewards)/len(mean_rewards)}')
+                    if num_threads > 0:
+                        stats = server.get_stats()
+                        print(f'inference: {stats["throughput"]:.0f} actions/s, '
+                              f'mean batch size {stats["mean_batch_size"]:.2f}, '
+                              f'mean latency {stats["mean_latency"] * 1000:.2f} ms')
+                        server.reset_stats()
+                    if num_actors > 0:
+                        print(f'staleness: {staleness}')
+                    loss = []
+                    if not flag:
+                        print(f'kill log :{kill_log}')
+                        print(f'time cost log ： {time_cost_log}')
+                    kill_log = []
+                    time_cost_log = []
+
+                if not test:
+                    checkpoints.maybe_save(epi, sum(mean_rewards)/len(mean_rewards),
+                                           lambda: make_checkpoint(agent, epi, env.get_observation_spec()))
+        finally:
+            checkpoints.close()
+            if show:
+                evaluator.close()
+            if num_workers > 0:
+                pool.close()
+            if num_threads > 0:
+                server.close()
+            if num_actors > 0:
+                actors.close()
 
 
 if __name__ == '__main__':
@@ -188,6 +364,19 @@ if __name__ == '__main__':
         'save': 5,
         'show': 5,
         'continue_last_train': True,
+        'num_envs': 1,
+        'num_workers': 0,
+        'num_threads': 0,
+        'num_actors': 0,
+        'max_staleness': None,
+        'off_policy_correction': False,
+        'save_seconds': None,
+        'keep_last': 3,
+        'keep_best': 3,
+        'agent': 'vpg',
+        'gae_lambda': None,
+        'eval_episodes': 3,
+        'record': False,
     }  # 参数的说明在 train 函数中
 
 
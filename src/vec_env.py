@@ -0,0 +1,98 @@
+import numpy as np
+
+import environment as Env
+
+
+class VecEnvironment:
+    """
+    同时驱动多个相互独立的 Environment，所有环境按相同的节奏一起前进
+
+    每次 step 接收一组动作（每个环境一个），返回堆叠后的 obs/rewards/dones，
+    因此智能体可以对全部环境的状态只做一次前向计算。
+    某个环境的一局游戏结束（或达到 max_step）后会被自动重置，
+    其余环境不受影响。各环境中尚未结束的一局游戏的数据（trajs）由 step 记录，
+    游戏结束时随 infos 一起返回。
+    """
+
+    def __init__(self, num_envs, show=0, debug=0, enemy_num=20, max_step=200, repeat=8, seed=None):
+        """
+        :param num_envs: int, 环境数量
+        :param show: 0/1, 是否展示画面
+        :param debug: 0/1, 是否打印环境中的信息
+        :param enemy_num: int, 每个环境一共会刷新多少个敌方坦克
+        :param max_step: int, 一局游戏中与环境交互的最大次数
+        :param repeat: int, 每个动作在环境中重复执行的帧数
+        :param seed: None/int, 给定时第 i 个环境使用种子 seed + i
+        """
+        self.envs = [
+            Env.Environment(show=show, debug=debug, enemy_num=enemy_num, seed=None if seed is None else seed + i)
+            for i in range(num_envs)
+        ]
+        self.num_envs = num_envs
+        self.max_step = max_step
+        self.repeat = repeat
+        # 各环境的当前状态，每个环境直接写入自己的一行
+        self.spec = self.envs[0].get_observation_spec()
+        self.obs = np.zeros((num_envs,) + self.spec['shape'], dtype=self.spec['dtype'])
+        self.ep_rets = [0] * num_envs
+        self.ep_lens = [0] * num_envs
+        # 各环境中尚未结束的一局游戏的数据，由 reset 分配，step 填充
+        self.trajs = None
+
+    def reset(self):
+        """
+        重置所有环境
+        :return: numpy.ndarray, 每个环境一行状态
+        """
+        for i, env in enumerate(self.envs):
+            env._reset(out=self.obs[i])
+            self.ep_rets[i], self.ep_lens[i] = 0, 0
+        self.trajs = [
+            {
+                'obs': np.zeros((self.max_step,) + self.spec['shape'], dtype=self.spec['dtype']),
+                'acts': np.zeros(self.max_step, dtype=np.int64),
+                'rews': [],
+            }
+            for _ in range(self.num_envs)
+        ]
+        return self.obs.copy()
+
+    def step(self, acts):
+        """
+        每个环境执行对应的动作（重复 repeat 帧），结束的环境自动重置
+
+        :param acts: list of int, 每个环境一个动作
+        :return:
+        obs: numpy.ndarray, 执行动作后各环境的状态，每个环境一行（已结束的环境为重置后的初始状态）
+        rews: list of float, 各环境得到的奖励（repeat 帧奖励的平均值）
+        dones: list of bool, 各环境的本局游戏是否在这一步结束（包括达到 max_step）
+        infos: list of dict, 对于结束的环境，记录本局的 ep_ret, ep_len, killed_enemy, done，
+            以及本局的轨迹 obs/acts/rews（复制出的数组，轨迹缓冲区会被下一局复用）
+        """
+        rews, dones, infos = [], [], []
+        for i, (env, act, traj) in enumerate(zip(self.envs, acts, self.trajs)):
+            step = self.ep_lens[i]
+            traj['obs'][step] = self.obs[i]
+            traj['acts'][step] = act
+            _, rew, done = env.step(act, repeat=self.repeat, out=self.obs[i])
+            traj['rews'].append(rew)
+            self.ep_rets[i] += rew
+            self.ep_lens[i] += 1
+            info = {}
+            if done or self.ep_lens[i] >= self.max_step:
+                info = {
+                    'ep_ret': self.ep_rets[i],
+                    'ep_len': self.ep_lens[i],
+                    'killed_enemy': env.get_killed_nums()[1],
+                    'done': done,
+                    'obs': traj['obs'][:self.ep_lens[i]].copy(),
+                    'acts': traj['acts'][:self.ep_lens[i]].copy(),
+                    'rews': np.asarray(traj['rews'], dtype=np.float32),
+                }
+                traj['rews'] = []
+                env._reset(out=self.obs[i])
+                self.ep_rets[i], self.ep_lens[i] = 0, 0
+            rews.append(rew)
+            dones.append(bool(info))
+            infos.append(info)
+        return self.obs.copy(), rews, dones, infos
@@ -0,0 +1,140 @@
+import torch
+import torch.multiprocessing as mp
+from torch.distributions.categorical import Categorical
+
+from net import MLP
+from returns import discounted_returns
+
+
+def _worker_loop(idx, conn, results, policy, buffers, enemy_num, max_step, repeat, seed):
+    """
+    子进程的主循环：拥有一个不显示画面的 Environment，
+    每收到一条 'run' 命令就用共享内存中的最新策略玩一局游戏，
+    把轨迹写进共享内存 buffers，再通过 results 通知主进程
+    """
+    torch.set_num_threads(1)
+    if seed is None:
+        torch.seed()
+    else:
+        torch.manual_seed(seed)
+
+    import environment as Env
+    env = Env.Environment(show=0, debug=0, enemy_num=enemy_num, seed=seed)
+
+    while True:
+        cmd = conn.recv()
+        if cmd != 'run':
+            break
+
+        # 环境直接把状态写进共享内存缓冲区的下一行，多出的一行存放最后一步之后的状态
+        obs = buffers['obs'].numpy()
+        env._reset(out=obs[0])
+        ep_rews = []
+        while True:
+            step = len(ep_rews)
+            with torch.no_grad():
+                act = Categorical(logits=policy(buffers['obs'][step])).sample().item()
+            _, rew, done = env.step(act, repeat=repeat, out=obs[step + 1])
+            buffers['acts'][step] = act
+            ep_rews.append(rew)
+            if done or len(ep_rews) >= max_step:
+                break
+
+        ep_len = len(ep_rews)
+        buffers['weights'][:ep_len] = discounted_returns(ep_rews)
+        buffers['rews'][:ep_len] = torch.as_tensor(ep_rews)
+        results.put((idx, sum(ep_rews), ep_len, env.get_killed_nums()[1], done))
+
+
+class RolloutWorkerPool:
+    """
+    多进程收集数据
+
+    每个子进程各自拥有一个不显示画面的 Environment，使数据收集可以用满多个 CPU 核。
+    主进程通过 set_weights 把策略参数写入共享内存中的网络，子进程直接读取；
+    子进程把一局游戏的 obs/acts/weights 写入各自的共享内存缓冲区，主进程再从中读出。
+    """
+
+    def __init__(self, num_workers, obs_dim, act_dim, enemy_num=20, max_step=200, repeat=8, seed=None):
+        """
+        :param num_workers: int, 子进程数量
+        :param obs_dim: int, 状态的维度
+        :param act_dim: int, 动作的数量
+        :param enemy_num: int, 每个环境一共会刷新多少个敌方坦克
+        :param max_step: int, 一局游戏中与环境交互的最大次数
+        :param repeat: int, 每个动作在环境中重复执行的帧数
+        :param seed: None/int, 给定时第 i 个子进程的环境和动作采样都使用种子 seed + i
+        """
+        ctx = mp.get_context('spawn')
+        self.num_workers = num_workers
+        self.policy = MLP(input_dim=obs_dim, output_dim=act_dim)
+        self.policy.share_memory()
+        self.results = ctx.Queue()
+        self.buffers, self.conns, self.procs = [], [], []
+        for idx in range(num_workers):
+            buffers = {
+                'obs': torch.zeros(max_step + 1, obs_dim).share_memory_(),
+                'acts': torch.zeros(max_step, dtype=torch.int64).share_memory_(),
+                'weights': torch.zeros(max_step).share_memory_(),
+                'rews': torch.zeros(max_step).share_memory_(),
+            }
+            parent_conn, child_conn = ctx.Pipe()
+            proc = ctx.Process(
+                target=_worker_loop,
+                args=(idx, child_conn, self.results, self.policy, buffers, enemy_num, max_step, repeat,
+                      None if seed is None else seed + idx),
+                daemon=True,
+            )
+            proc.start()
+            self.buffers.append(buffers)
+            self.conns.append(parent_conn)
+            self.procs.append(proc)
+
+    def set_weights(self, state_dict):
+        """
+        把学习者的最新参数复制到共享内存中的网络，只能在 run 之外调用
+        :param state_dict: agent.logits_net.state_dict()
+        """
+        self.policy.load_state_dict(state_dict)
+
+    def run(self, batch, num_episodes):
+        """
+        用所有子进程一共玩 num_episodes 局游戏，收集数据
+
+        :param batch: 用于收集数据的字典
+        :param num_episodes: int, 需要收集的完整游戏局数
+        :return: list of (ep_ret, ep_len, killed_enemy, done)，每局游戏一个
+        """
+        pending = num_episodes
+        running = 0
+        for conn in self.conns[:num_episodes]:
+            conn.send('run')
+            pending -= 1
+            running += 1
+
+        results = []
+        while running:
+            idx, ep_ret, ep_len, killed_enemy, done = self.results.get()
+            running -= 1
+            buffers = self.buffers[idx]
+            batch['obs'].append(buffers['obs'][:ep_len].numpy().copy())
+            batch['acts'].append(buffers['acts'][:ep_len].numpy().copy())
+            batch['weights'].append(buffers['weights'][:ep_len].numpy().copy())
+            batch['rews'].append(buffers['rews'][:ep_len].numpy().copy())
+            batch['rets'].append(ep_ret)
+            batch['lens'].append(ep_len)
+            results.append((ep_ret, ep_len, killed_enemy, done))
+            # 数据已读出，该子进程的缓冲区可以复用
+            if pending:
+                self.conns[idx].send('run')
+                pending -= 1
+                running += 1
+        return results
+
+    def close(self):
+        for conn in self.conns:
+            conn.send('close')
+        for proc in self.procs:
+            proc.join()
+        self.results.close()
+        self.results.join_thread()